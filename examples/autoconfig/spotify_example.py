@@ -1,7 +1,7 @@
 import os
 import pymongo
 from mongrel_transferrer import ConfigurationBuilder
-from mongrel_transferrer import transfer_data_from_mongo_to_postgres
+from mongrel_transferrer import transfer_data_from_mongo_to_postgres, TransferOptions, WriteOptions
 
 if __name__ == "__main__":
     client = pymongo.MongoClient('localhost', 27017)
@@ -12,5 +12,6 @@ if __name__ == "__main__":
                                          mongo_database="hierarchical_relational_test",
                                          mongo_collection="test_tracks",
                                          sql_host='127.0.0.1', sql_database='spotify', sql_user='postgres',
-                                         sql_port=35433, sql_password=os.getenv("PASSWORD"), batch_size=5000,
+                                         sql_port=35433, sql_password=os.getenv("PASSWORD"),
+                                         options=TransferOptions(write=WriteOptions(batch_size=5000)),
                                          keep_list_alias_relations=False)
@@ -1,2 +1,5 @@
 from .mongrel.objects.transferrer import transfer_data_from_mongo_to_postgres
 from .mongrel.relation_discovery.configuration_builder import ConfigurationBuilder
+from .mongrel.objects.enums import WriteMethod
+from .mongrel.objects.sink import FileSink, PostgresSink
+from .mongrel.objects.options import CheckpointOptions, ReadOptions, TransferOptions, WriteOptions
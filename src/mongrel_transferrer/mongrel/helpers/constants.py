@@ -25,6 +25,7 @@ REFERENCE_KEY = "reference_keys"
 SOURCE_TYPE = "source_type"
 TARGET_TYPE = "target_type"
 CONV_ARGS = "args"
+CACHE_SIZE = "cache_size"
 PATH_SEP = "👏"
 TRAN_OPTIONS = "transfer_options"
 ALIAS = "alias"
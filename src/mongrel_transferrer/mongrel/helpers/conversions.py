@@ -34,14 +34,40 @@ This configuration will be parsed the following:
 2. The returned string_to_date function will be called everytime a release_date field is read with
 val=release_date_value and kwargs={"format": "%Y-%m-%d"}
 3. The converted value is then stored to be written to the database
+A conversion can additionally register a batch version with register_batch_conversion. The batch version converts a
+whole buffered column right before the table is written, see objects_to_str for an example.
 """
+from collections import OrderedDict
+from collections.abc import Callable
 from datetime import datetime
 
+import pandas as pd
+
 
 class Conversions:
     """
     This class stores all the conversion functions and needs to be extended for other use cases
     """
+    batch_conversions: dict[Callable, Callable] = {}
+
+    @staticmethod
+    def register_batch_conversion(conversion_function: Callable, batch_function: Callable) -> None:
+        """
+        Registers the batch version of a conversion function. The batch version is called with the list of all
+        buffered values of a column and the args of the mapping file and returns the list of converted values. None
+        values have to stay None, the scalar version is never called for them.
+        :param conversion_function: the scalar conversion function
+        :param batch_function: the function converting a whole column
+        """
+        Conversions.batch_conversions[conversion_function] = batch_function
+
+    @staticmethod
+    def get_batch_conversion(conversion_function: Callable) -> Callable:
+        """
+        :param conversion_function: the scalar conversion function
+        :return: the registered batch version or None if the values have to be converted one by one
+        """
+        return Conversions.batch_conversions.get(conversion_function)
 
     @staticmethod
     def get_conversion(source_type: str, target_type: str):
@@ -95,7 +121,8 @@ class Conversions:
     @staticmethod
     def string_to_date(val: str, **kwargs):
         """
-        Takes a string and parses it to a date.
+        Takes a string and parses it to a date. If there are multiple input formats, the format that matched last is
+        moved to the front of the list in kwargs, so the formats should not be ambiguous.
         :param val: the value that needs to be converted
         :param kwargs: these keyword arguments get filled with the args given in the mapping file
         :return: the converted value
@@ -105,14 +132,121 @@ class Conversions:
         formats = kwargs["input_format"]
         if not isinstance(formats, list):
             formats = [formats]
-        for form in formats:
+        for idx, form in enumerate(formats):
             try:
                 parsed = datetime.strptime(val, form)
-                return parsed.strftime(kwargs["output_format"])
             except ValueError:
-                pass
+                continue
+            if idx > 0 and formats is kwargs["input_format"]:
+                # the next values most likely have the same format, it is tried first from now on
+                formats.insert(0, formats.pop(idx))
+            return parsed.strftime(kwargs["output_format"])
         raise ValueError(f"Value {val} could not be converted with the given formats {formats}")
 
+    @staticmethod
+    def parse_dates(values: pd.Series, formats: list[str], output_format: str) -> pd.Series:
+        """
+        Parses the values with pandas, every distinct value is parsed once. Every format is tried on the values the
+        formats before could not parse.
+        :param values: the strings to parse
+        :param formats: the input formats in the order they are tried
+        :param output_format: the format of the returned strings
+        :return: the formatted dates, None for every value none of the formats could parse
+        """
+        remaining = pd.Series(values.unique(), dtype=object)
+        formatted = {}
+        for form in formats:
+            if remaining.empty:
+                break
+            try:
+                parsed = pd.to_datetime(remaining, format=form, errors="coerce")
+            except (ValueError, TypeError):
+                # e.g. mixed time zones, the scalar version handles these values
+                break
+            hits = parsed.notna()
+            formatted.update(zip(remaining[hits], parsed[hits].dt.strftime(output_format)))
+            remaining = remaining[~hits]
+        return pd.Series([formatted.get(value) for value in values], index=values.index, dtype=object)
+
+    @staticmethod
+    def convert_leftovers(values: list, converted: pd.Series, conversion_function: Callable, **kwargs) -> list:
+        """
+        Converts the values a batch version could not handle with the scalar version, e.g. dates outside of the
+        range of pandas. Values that are invalid raise the error of the scalar version.
+        :param values: the original values
+        :param converted: the converted values, None where the batch version failed
+        :param conversion_function: the scalar version
+        :param kwargs: the args of the mapping file
+        :return: the converted values
+        """
+        result = converted.tolist()
+        for idx, value in enumerate(values):
+            if result[idx] is None and value is not None:
+                result[idx] = conversion_function(value, **kwargs)
+        return result
+
+    @staticmethod
+    def objects_to_str(values: list) -> list:
+        """
+        Batch version of object_to_str
+        :param values: the values of the column
+        :return: the strings of the values
+        """
+        return [str(val) if val is not None else None for val in values]
+
+    @staticmethod
+    def strings_to_date(values: list, **kwargs) -> list:
+        """
+        Batch version of string_to_date
+        :param values: the values of the column
+        :param kwargs: these keyword arguments get filled with the args given in the mapping file
+        :return: the converted values
+        """
+        formats = kwargs["input_format"]
+        if not isinstance(formats, list):
+            formats = [formats]
+        series = pd.Series(values, dtype=object)
+        candidates = series[series.notna() & (series != "") & (series.map(type) == str)]
+        converted = pd.Series([None] * len(series.index), index=series.index, dtype=object)
+        converted.update(Conversions.parse_dates(candidates, formats, kwargs["output_format"]))
+        empty = series.isna() | (series == "")
+        return Conversions.convert_leftovers(series.where(~empty, None).tolist(), converted,
+                                             Conversions.string_to_date, **kwargs)
+
+    @staticmethod
+    def strings_to_spotify_date(values: list, **kwargs) -> list:
+        """
+        Batch version of string_to_spotify_date
+        :param values: the values of the column
+        :param kwargs: these keyword arguments get filled with the args given in the mapping file
+        :return: the converted values
+        """
+        series = pd.Series(values, dtype=object)
+        valid = series.notna() & (series != "0000")
+        strings = series[valid & (series.map(type) == str)]
+        lengths = strings.map(len)
+        converted = pd.Series([None] * len(series.index), index=series.index, dtype=object)
+        for length, form in ((4, "%Y"), (7, "%Y-%M")):
+            converted.update(Conversions.parse_dates(strings[lengths == length], [form], "%Y-%m-%d"))
+        others = strings[(lengths != 4) & (lengths != 7)]
+        converted.update(Conversions.parse_dates(others, [kwargs["format"]], "%Y-%m-%d"))
+        return Conversions.convert_leftovers(series.where(valid, None).tolist(), converted,
+                                             Conversions.string_to_spotify_date, **kwargs)
+
+    @staticmethod
+    def remove_null_characters_many(values: list) -> list:
+        """
+        Batch version of remove_null_characters
+        :param values: the values of the column
+        :return: the values without null characters
+        """
+        series = pd.Series(values, dtype=object)
+        strings = series[series.map(type) == str]
+        converted = pd.Series([None] * len(series.index), index=series.index, dtype=object)
+        if not strings.empty:
+            converted.update(strings.str.replace("\x00", "", regex=False))
+        return Conversions.convert_leftovers(values, converted, Conversions.remove_null_characters)
+
     @staticmethod
     def do_nothing(val: object):
         """
@@ -131,3 +265,50 @@ class Conversions:
         :return: the converted value
         """
         return val.replace("\x00", "")
+
+
+
+class CachedConversion:
+    """
+    Calls a conversion function with the args of its column. Optionally the results of the most recently converted
+    distinct values are remembered, so repeated values are converted only once.
+    """
+    function: Callable
+    args: dict
+    cache_size: int
+    _cache: OrderedDict
+
+    def __init__(self, function: Callable, args: dict = None, cache_size: int = 0):
+        """
+        :param function: the conversion function
+        :param args: the keyword arguments the function is called with
+        :param cache_size: the number of distinct values whose results are remembered, 0 disables the cache
+        """
+        self.function = function
+        self.args = args if args is not None else {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __call__(self, value: object) -> object:
+        if self.cache_size <= 0:
+            return self.function(value, **self.args)
+        # the type is part of the key, 1, 1.0 and True are equal but converted differently
+        key = (type(value), value)
+        try:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        except TypeError:
+            # unhashable values are converted every time
+            return self.function(value, **self.args)
+        result = self.function(value, **self.args)
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+
+Conversions.register_batch_conversion(Conversions.object_to_str, Conversions.objects_to_str)
+Conversions.register_batch_conversion(Conversions.string_to_date, Conversions.strings_to_date)
+Conversions.register_batch_conversion(Conversions.string_to_spotify_date, Conversions.strings_to_spotify_date)
+Conversions.register_batch_conversion(Conversions.remove_null_characters, Conversions.remove_null_characters_many)
@@ -16,8 +16,21 @@
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
     Helper functions for the pandas upload functionality.
 """
+import io
+import math
+from collections.abc import Iterable
+
+from pandas.io.sql import SQLTable
+from sqlalchemy import Connection, column, delete, select, table as table_clause, tuple_
 from sqlalchemy.dialects.postgresql import insert
 
+STAGING_PREFIX = "mongrel_stage_"
+NULL_MARKER = "\\N"
+# csv values containing these characters or matching the null marker or the end of data marker are quoted
+CSV_SPECIAL_CHARACTERS = (",", '"', "\n", "\r")
+DELETE_CHUNK_SIZE = 10000
+KEY_CHUNK_SIZE = 10000
+
 
 def insert_on_conflict_nothing(table, conn, keys, data_iter):
     """
@@ -28,3 +41,227 @@ def insert_on_conflict_nothing(table, conn, keys, data_iter):
     stmt = insert(table.table).values(data).on_conflict_do_nothing()
     result = conn.execute(stmt)
     return result.rowcount
+
+
+def deduplicate_rows(keys: list[str], rows: Iterable[tuple], pks: list[str], skip_nulls: bool = False) -> list[tuple]:
+    """
+    Removes rows with the same primary key, the last row wins. Postgres refuses to update the same row twice within
+    one statement.
+    :param keys: the column names of the rows
+    :param rows: the rows
+    :param pks: the primary key columns
+    :param skip_nulls: if True the null values of a row keep the values of the rows before it
+    :return: the rows with unique primary keys
+    """
+    positions = [keys.index(pk) for pk in pks]
+    unique = {}
+    for row in rows:
+        key = tuple(row[position] for position in positions)
+        previous = unique.get(key)
+        if skip_nulls and previous is not None:
+            row = tuple(old if value is None else value for old, value in zip(previous, row))
+        unique[key] = row
+    return list(unique.values())
+
+
+def group_by_update_columns(keys: list[str], rows: list[tuple], pks: list[str],
+                            skip_nulls: bool = False) -> dict[tuple[str, ...], list[tuple]]:
+    """
+    Groups the rows by the columns they update. Relations sharing an alias write into the same table, each of them
+    only fills its own columns. With skip_nulls a row only updates its non-null columns, so the relations don't
+    overwrite each other's columns with nulls.
+    :param keys: the column names of the rows
+    :param rows: the rows
+    :param pks: the primary key columns
+    :param skip_nulls: if True only the non-null columns of a row are updated, otherwise all of them
+    :return: the rows for every tuple of updated columns
+    """
+    update_positions = [(position, key) for position, key in enumerate(keys) if key not in pks]
+    if not skip_nulls:
+        return {tuple(key for _, key in update_positions): rows} if rows else {}
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(key for position, key in update_positions if row[position] is not None),
+                          []).append(row)
+    return groups
+
+
+def insert_on_conflict_update(table, conn, keys, data_iter, pks: list[str], skip_nulls: bool = False):
+    """
+    Inserts the rows and updates all columns that are not part of the primary key of the rows that already exist.
+    With skip_nulls only the non-null columns of a row are updated.
+    Needs the primary key, so it is handed to pandas with functools.partial.
+    """
+    keys = list(keys)
+    if not pks or all(key in pks for key in keys):
+        return insert_on_conflict_nothing(table, conn, keys, data_iter)
+    rowcount = 0
+    rows = deduplicate_rows(keys, data_iter, pks, skip_nulls)
+    for update_columns, group in group_by_update_columns(keys, rows, pks, skip_nulls).items():
+        stmt = insert(table.table).values([dict(zip(keys, row)) for row in group])
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(index_elements=pks,
+                                              set_={key: stmt.excluded[key] for key in update_columns})
+        else:
+            stmt = stmt.on_conflict_do_nothing()
+        rowcount += conn.execute(stmt).rowcount
+    return rowcount
+
+
+def delete_by_keys(conn: object, table_name: str, schema: str, key_columns: list[str], keys: list[tuple]) -> None:
+    """
+    Deletes all rows whose key columns match one of the keys
+    :param conn: the connection to the target database
+    :param table_name: the name of the table
+    :param schema: the schema of the table
+    :param key_columns: the columns the keys are matched against
+    :param keys: the keys of the rows to delete
+    """
+    target = table_clause(table_name, *[column(name) for name in key_columns], schema=schema if schema else None)
+    key_clause = tuple_(*[target.c[name] for name in key_columns])
+    keys = list(keys)
+    for start in range(0, len(keys), DELETE_CHUNK_SIZE):
+        conn.execute(delete(target).where(key_clause.in_(keys[start:start + DELETE_CHUNK_SIZE])))
+
+
+def stream_keys(conn: object, table_name: str, schema: str, key_columns: list[str]) -> Iterable[tuple]:
+    """
+    Reads the keys of all rows of a table with a server side cursor, so the table is never loaded at once
+    :param conn: the connection to the target database
+    :param table_name: the name of the table
+    :param schema: the schema of the table
+    :param key_columns: the columns of the keys
+    :return: yields the keys as tuples in the order of the key columns
+    """
+    target = table_clause(table_name, *[column(name) for name in key_columns], schema=schema if schema else None)
+    result = conn.execute(select(*[target.c[name] for name in key_columns])
+                          .execution_options(stream_results=True, yield_per=KEY_CHUNK_SIZE))
+    for row in result:
+        yield tuple(row)
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quotes an identifier for raw sql statements
+    :param name: the schema, table or column name
+    :return: the quoted identifier
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def qualified_name(table_name: str, schema: str = None) -> str:
+    """
+    Builds the quoted and schema qualified name of a table
+    :param table_name: the name of the table
+    :param schema: optional, the schema of the table
+    :return: the qualified name, usable in raw sql statements
+    """
+    if schema:
+        return f'{quote_identifier(schema)}.{quote_identifier(table_name)}'
+    return quote_identifier(table_name)
+
+
+def staging_name(table_name: str, schema: str = None) -> str:
+    """
+    Builds the quoted name of the temporary staging table of a table
+    :param table_name: the name of the table
+    :param schema: optional, the schema of the table
+    :return: the quoted name of the staging table
+    """
+    return quote_identifier(f'{STAGING_PREFIX}{schema + "_" if schema else ""}{table_name}')
+
+
+def to_copy_value(value: object) -> str:
+    """
+    Converts a value to its representation in the text format of postgres COPY
+    :param value: the value to write
+    :return: the escaped string representation
+    """
+    if value is None:
+        return NULL_MARKER
+    if isinstance(value, float):
+        if math.isnan(value):
+            return NULL_MARKER
+        if value.is_integer():
+            # pandas turns integer columns with missing values into floats, postgres won't read 7.0 as an integer
+            return str(int(value))
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+
+
+def to_csv_value(value: object) -> str:
+    """
+    Converts a value to its representation in csv files read by COPY ... WITH (FORMAT csv, NULL '\\N'). Null values
+    are the unquoted null marker. Empty strings and strings that contain separators or could be read as the null
+    marker are quoted, COPY only compares unquoted values with it.
+    :param value: the value to write
+    :return: the csv field
+    """
+    if value is None:
+        return NULL_MARKER
+    if isinstance(value, float):
+        if math.isnan(value):
+            return NULL_MARKER
+        if value.is_integer():
+            return str(int(value))
+    text = str(value)
+    if text in ("", NULL_MARKER, "\\.") or any(character in text for character in CSV_SPECIAL_CHARACTERS):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _copy_and_merge(table: SQLTable, conn: Connection, keys: list[str], rows: Iterable[tuple],
+                    conflict_clause: str) -> int:
+    """
+    Streams the rows with COPY into a temporary staging table and merges it into the target table with a single
+    INSERT ... SELECT. The staging table lives as long as the session and is reused for every batch of the table.
+    :param table: the pandas table
+    :param conn: the connection to the target database
+    :param keys: the column names
+    :param rows: the rows to write
+    :param conflict_clause: the ON CONFLICT clause of the merge
+    :return: the number of merged rows
+    """
+    target = qualified_name(table.table.name, table.table.schema)
+    staging = staging_name(table.table.name, table.table.schema)
+    columns = ", ".join(quote_identifier(key) for key in keys)
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(to_copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    dbapi_connection = conn.connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {staging} (LIKE {target} INCLUDING DEFAULTS)')
+        cursor.execute(f'TRUNCATE {staging}')
+        cursor.copy_expert(f'COPY {staging} ({columns}) FROM STDIN', buffer)
+        cursor.execute(f'INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} {conflict_clause}')
+        return cursor.rowcount
+
+
+def copy_on_conflict_nothing(table, conn, keys, data_iter):
+    """
+    Same conflict behaviour as insert_on_conflict_nothing but streams the rows with COPY into a temporary staging table
+    first. The staging table is then merged into the target with a single INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    Like insert_on_conflict_nothing it is called by pandas.
+    """
+    return _copy_and_merge(table, conn, keys, data_iter, "ON CONFLICT DO NOTHING")
+
+
+def copy_on_conflict_update(table, conn, keys, data_iter, pks: list[str], skip_nulls: bool = False):
+    """
+    Same conflict behaviour as insert_on_conflict_update but streams the rows through a staging table with COPY.
+    Needs the primary key, so it is handed to pandas with functools.partial.
+    """
+    keys = list(keys)
+    if not pks or all(key in pks for key in keys):
+        return copy_on_conflict_nothing(table, conn, keys, data_iter)
+    rowcount = 0
+    rows = deduplicate_rows(keys, data_iter, pks, skip_nulls)
+    for update_columns, group in group_by_update_columns(keys, rows, pks, skip_nulls).items():
+        conflict_clause = "ON CONFLICT DO NOTHING"
+        if update_columns:
+            conflict_clause = (f'ON CONFLICT ({", ".join(quote_identifier(pk) for pk in pks)}) DO UPDATE SET '
+                               + ", ".join(f'{quote_identifier(key)} = EXCLUDED.{quote_identifier(key)}'
+                                           for key in update_columns))
+        rowcount += _copy_and_merge(table, conn, keys, group, conflict_clause)
+    return rowcount
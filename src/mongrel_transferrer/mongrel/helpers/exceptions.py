@@ -24,3 +24,11 @@ class MalformedMappingException(Exception):
     This Exception is called when there are issues within the configuration File.
     A configuration file should not contain any circular dependencies and information on all tables used
     """
+
+
+class FanOutLimitException(Exception):
+    """
+    This Exception is raised when a single document fans out into more rows than the configured limit allows.
+    Sibling lists within a table are combined with a cartesian product, the limit stops such documents before their
+    rows fill the memory.
+    """
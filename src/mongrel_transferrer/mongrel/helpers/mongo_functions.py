@@ -0,0 +1,119 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+    Helper functions for reading from the source mongo.
+"""
+from datetime import datetime
+from collections.abc import Iterator
+
+import pymongo
+from bson import ObjectId
+
+SAMPLES_PER_PARTITION = 32
+
+
+def get_bson_type_alias(value: object) -> str:
+    """
+    Finds the alias mongo uses for the type of value in $type queries
+    :param value: a value of the collection
+    :return: the alias or None if the type is not supported for partitioning
+    """
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, datetime):
+        return "date"
+    return None
+
+
+def compute_id_partitions(collection: pymongo.collection.Collection, partitions: int) -> list[dict]:
+    """
+    Splits the collection into _id ranges of roughly the same size. The split points are taken from a random sample
+    of the _ids, so the collection is not scanned.
+    Mongo only compares values of the same type in range queries. Documents with an _id of another type than the
+    sampled ones are collected in an extra partition so that no document gets lost.
+    :param collection: the source collection
+    :param partitions: the number of wanted partitions
+    :return: the queries selecting the partitions, together they select every document exactly once
+    """
+    if partitions <= 1:
+        return [{}]
+    sampled = [doc["_id"] for doc in collection.aggregate(
+        [{"$sample": {"size": partitions * SAMPLES_PER_PARTITION}}, {"$project": {"_id": 1}}])]
+    aliases = {get_bson_type_alias(value) for value in sampled}
+    if len(aliases) != 1 or None in aliases:
+        return [{}]
+    alias = aliases.pop()
+    sampled = sorted(set(sampled))
+    step = len(sampled) / partitions
+    split_points = []
+    for idx in range(1, partitions):
+        split_point = sampled[int(idx * step)]
+        if not split_points or split_points[-1] != split_point:
+            split_points.append(split_point)
+    queries = []
+    lower = None
+    for split_point in split_points + [None]:
+        bounds = {"$type": alias}
+        if lower is not None:
+            bounds["$gte"] = lower
+        if split_point is not None:
+            bounds["$lt"] = split_point
+        queries.append({"_id": bounds})
+        lower = split_point
+    queries.append({"_id": {"$not": {"$type": alias}}})
+    return queries
+
+
+def build_projection(paths: list[list[str]]) -> dict:
+    """
+    Builds the projection that reads only the fields at the given paths. A path that is contained in a shorter path
+    is left out, mongo refuses projections with collisions. The _id is always part of the projection.
+    :param paths: the paths of all fields that are read, as lists of keys
+    :return: the projection or None if a path can't be projected and the documents need to be read completely
+    """
+    if not paths:
+        return None
+    projection = {}
+    for path in sorted({tuple(path) for path in paths}, key=lambda path: (len(path), path)):
+        if not path or any(not key or "." in key or key.startswith("$") for key in path):
+            return None
+        if any(".".join(path[:idx]) in projection for idx in range(1, len(path) + 1)):
+            continue
+        projection[".".join(path)] = 1
+    return projection
+
+
+def sample_documents(collection: pymongo.collection.Collection, size: int) -> Iterator:
+    """
+    Reads a random sample of the collection with $sample. $sample may return a document more than once, the repeated
+    documents are skipped.
+    :param collection: the source collection
+    :param size: the number of documents in the sample
+    :return: yields the sampled documents
+    """
+    seen = set()
+    for doc in collection.aggregate([{"$sample": {"size": size}}], allowDiskUse=True):
+        key = (type(doc["_id"]).__name__, str(doc["_id"]))
+        if key in seen:
+            continue
+        seen.add(key)
+        yield doc
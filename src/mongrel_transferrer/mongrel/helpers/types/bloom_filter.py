@@ -1,34 +1,388 @@
+from __future__ import annotations
+
+import copy
 import math
 import mmh3
 import numpy
 
+HASH_SEED = 42
+UINT64_MASK = 0xFFFFFFFFFFFFFFFF
+# the multipliers of the splitmix64 finalizer
+MIX_MULTIPLIERS = (0xBF58476D1CE4E5B9, 0x94D049BB133111EB)
+INITIAL_CAPACITY = 1024
+MAX_SLICES = 32
+
+
+class MemoryBudget:
+    """
+    The memory all scalable bloom filters of a discovery may take together
+    """
+    limit: int
+    used: int
+    exhausted: bool
+
+    def __init__(self, limit: int = None):
+        """
+        :param limit: the number of bytes, None for no limit
+        """
+        self.limit = limit
+        self.used = 0
+        self.exhausted = False
+
+    def reserve(self, nbytes: int) -> bool:
+        """
+        Reserves memory for a new slice
+        :param nbytes: the size of the slice
+        :return: False if the budget does not allow it, the slice should not be created then
+        """
+        if self.limit is not None and self.used + nbytes > self.limit:
+            self.exhausted = True
+            return False
+        self.used += nbytes
+        return True
+
+    def charge(self, nbytes: int) -> None:
+        """
+        Counts memory that has to be kept anyway, e.g. the hash pairs of unique columns in the discovery workers. If
+        it exceeds the limit, no further slices are created.
+        :param nbytes: the number of bytes
+        """
+        self.used += nbytes
+        if self.limit is not None and self.used > self.limit:
+            self.exhausted = True
+
+    def release(self, nbytes: int) -> None:
+        """
+        Returns memory counted with charge
+        :param nbytes: the number of bytes
+        """
+        self.used -= nbytes
+
 
 class BloomFilter:
+    """
+    A bloom filter of fixed size, the bits are packed into bytes. The positions of an item follow the double hashing
+    h1 + i * h2 with an odd h2, which visits distinct 64-bit values, and every value is mixed before it is reduced to
+    the size. So the positions don't form an arithmetic progression modulo the size, which would set only a few
+    distinct bits when h2 shares factors with the size and would make items whose progressions overlap share almost
+    all of their bits.
+    """
     lookup: numpy.ndarray
     hash_functions: int
     size: int
+    capacity: int
+    count: int
 
-    def __init__(self, expected_values: int, false_positive_acceptance: float = 0.00001):
+    def __init__(self, expected_values: int, false_positive_acceptance: float = 0.00001, size: int = None):
         self.size = math.ceil(
             (expected_values * math.log(false_positive_acceptance)) / math.log(1 / pow(2, math.log(2))))
-        self.lookup = numpy.zeros(self.size, dtype=bool)
+        if size is not None:
+            self.size = size
+        self.lookup = numpy.zeros((self.size + 7) // 8, dtype=numpy.uint8)
         self.hash_functions = round((self.size / expected_values) * math.log(2)) if expected_values > 0 else 0
+        self.capacity = expected_values
+        self.count = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.lookup.nbytes
+
+    @staticmethod
+    def hash_pair(item: object) -> tuple[int, int]:
+        """
+        Hashes the item once, the two halves of the 128-bit hash are the base hashes of the double hashing
+        :param item: the item to hash
+        :return: the two 64-bit halves
+        """
+        return mmh3.hash64(str(item), HASH_SEED, signed=False)
+
+    @staticmethod
+    def hash_pairs(items: list) -> numpy.ndarray:
+        """
+        Hashes many items at once, the pairs can be reused by other sketches of the same values
+        :param items: the items to hash
+        :return: an uint64 array with one row of base hashes per item
+        """
+        return numpy.array([BloomFilter.hash_pair(item) for item in items], dtype=numpy.uint64).reshape(-1, 2)
+
+    @staticmethod
+    def mix(value: int) -> int:
+        """
+        The finalizer of splitmix64, a bijection of the 64-bit integers that spreads every input bit over all bits
+        :param value: the 64-bit integer to mix
+        :return: the mixed integer
+        """
+        value = ((value ^ (value >> 30)) * MIX_MULTIPLIERS[0]) & UINT64_MASK
+        value = ((value ^ (value >> 27)) * MIX_MULTIPLIERS[1]) & UINT64_MASK
+        return value ^ (value >> 31)
+
+    @staticmethod
+    def mix_many(pairs: numpy.ndarray, hash_functions: int) -> numpy.ndarray:
+        """
+        Computes the mixed double hashes of many items at once, uint64 arithmetic wraps around just like the masked
+        python ints of positions. They don't depend on the size, filters with the same number of hash functions
+        only have to reduce them.
+        :param pairs: the hash pairs of the items
+        :param hash_functions: the number of hash functions
+        :return: an uint64 array with one row of mixed hashes per item
+        """
+        steps = numpy.arange(hash_functions, dtype=numpy.uint64)
+        values = pairs[:, :1] + steps * (pairs[:, 1:] | numpy.uint64(1))
+        values ^= values >> numpy.uint64(30)
+        values *= numpy.uint64(MIX_MULTIPLIERS[0])
+        values ^= values >> numpy.uint64(27)
+        values *= numpy.uint64(MIX_MULTIPLIERS[1])
+        values ^= values >> numpy.uint64(31)
+        return values
 
     def hash(self, item: object):
-        hash_value_life = mmh3.hash(str(item), 42, signed=False)
-        hash_value_blaze = mmh3.hash(str(item), 420, signed=False)
+        return self.positions(BloomFilter.hash_pair(item))
+
+    def positions(self, pair: tuple[int, int]):
+        """
+        :param pair: the hash pair of an item
+        :return: yields the bit positions of the item
+        """
+        hash_value_life, hash_value_blaze = pair
+        hash_value_blaze |= 1
         for i in range(self.hash_functions):
-            yield (hash_value_life + i * hash_value_blaze) % self.size
+            yield BloomFilter.mix((hash_value_life + i * hash_value_blaze) & UINT64_MASK) % self.size
+
+    def hash_many(self, items: list, pairs: numpy.ndarray = None, mixed: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Computes the bit positions of many items at once
+        :param items: the items to hash
+        :param pairs: optional, the already computed hash pairs of the items
+        :param mixed: optional, the already computed mixed hashes of the items
+        :return: an array with one row of bit positions per item
+        """
+        if mixed is None:
+            if pairs is None:
+                pairs = BloomFilter.hash_pairs(items)
+            mixed = BloomFilter.mix_many(pairs, self.hash_functions)
+        return (mixed % numpy.uint64(self.size)).astype(numpy.intp)
+
+    def _get_bits(self, positions: numpy.ndarray) -> numpy.ndarray:
+        return ((self.lookup[positions >> 3] >> (positions & 7).astype(numpy.uint8)) & 1).astype(bool)
+
+    def _set_bits(self, positions: numpy.ndarray) -> None:
+        numpy.bitwise_or.at(self.lookup, positions >> 3, numpy.left_shift(1, positions & 7).astype(numpy.uint8))
 
     def check(self, item: object) -> bool:
-        return all(self.lookup[i] for i in self.hash(item))
+        return self.check_pair(BloomFilter.hash_pair(item))
+
+    def check_pair(self, pair: tuple[int, int]) -> bool:
+        return all((self.lookup[i >> 3] >> (i & 7)) & 1 for i in self.positions(pair))
+
+    def check_many(self, items: list, pairs: numpy.ndarray = None, mixed: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Checks many items at once
+        :param items: the items to check
+        :param pairs: optional, the already computed hash pairs of the items
+        :param mixed: optional, the already computed mixed hashes of the items
+        :return: a boolean array, True for every item that is probably contained
+        """
+        if self.hash_functions == 0 or self.size == 0:
+            return numpy.ones(len(items), dtype=bool)
+        return self._get_bits(self.hash_many(items, pairs, mixed)).all(axis=1)
 
     def add(self, item: object, checked: bool = False):
         if not checked:
             if self.check(item):
                 return
-        for i in self.hash(item):
-            self.lookup[i] = True
+        self.add_pair(BloomFilter.hash_pair(item))
+
+    def add_pair(self, pair: tuple[int, int]) -> None:
+        for i in self.positions(pair):
+            self.lookup[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def add_many(self, items: list, pairs: numpy.ndarray = None) -> None:
+        """
+        Adds many items at once
+        :param items: the items to add
+        :param pairs: optional, the already computed hash pairs of the items
+        """
+        if self.hash_functions == 0 or self.size == 0 or not items:
+            return
+        self._set_bits(self.hash_many(items, pairs).ravel())
+        self.count += len(items)
+
+    def check_and_add_many(self, items: list, pairs: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Checks and adds many items at once. An item also counts as contained if it appears earlier in the same batch.
+        :param items: the items to check and add
+        :param pairs: optional, the already computed hash pairs of the items
+        :return: a boolean array, True for every item that was probably contained before
+        """
+        if self.hash_functions == 0 or self.size == 0:
+            return numpy.ones(len(items), dtype=bool)
+        positions = self.hash_many(items, pairs)
+        contained = self._get_bits(positions).all(axis=1)
+        _, first = numpy.unique(positions, axis=0, return_index=True)
+        repeated = numpy.ones(len(items), dtype=bool)
+        repeated[first] = False
+        self._set_bits(positions.ravel())
+        self.count += int(numpy.count_nonzero(~(contained | repeated)))
+        return contained | repeated
+
+    def union(self, other: BloomFilter) -> BloomFilter:
+        """
+        Combines two filters of the same size, the result contains the items of both
+        :param other: the other filter
+        :return: a new filter
+        """
+        merged = copy.copy(self)
+        merged.lookup = self.lookup | other.lookup
+        merged.count = self.count + other.count
+        return merged
+
+    def __contains__(self, item):
+        return self.check(item)
+
+
+class ScalableBloomFilter:
+    """
+    A bloom filter that starts small and adds slices as they fill up, so its memory follows the number of distinct
+    items instead of the worst case. Every slice is twice as large as the one before and holds twice the items with
+    the same hash functions. The acceptance is split across up to MAX_SLICES slices. Once the memory budget is used up
+    no slices are added, the last slice keeps filling and its false positive rate rises.
+    """
+    slices: list[BloomFilter]
+    initial_capacity: int
+    false_positive_acceptance: float
+    base_size: int
+    budget: MemoryBudget
+
+    def __init__(self, expected_values: int, false_positive_acceptance: float = 0.00001,
+                 budget: MemoryBudget = None):
+        """
+        :param expected_values: the maximum number of items, the first slice holds at most INITIAL_CAPACITY of them.
+        0 creates a filter that can't hold items.
+        :param false_positive_acceptance: the false positive rate of all slices together
+        :param budget: optional, the memory budget shared with other filters
+        """
+        self.initial_capacity = min(expected_values, INITIAL_CAPACITY)
+        self.false_positive_acceptance = false_positive_acceptance
+        self.budget = budget
+        self.slices = []
+        self.base_size = 0
+        if self.initial_capacity > 0:
+            size = BloomFilter(self.initial_capacity, false_positive_acceptance / MAX_SLICES).size
+            self.base_size = (size + 7) // 8 * 8
+            self._add_slice()
+
+    @property
+    def size(self) -> int:
+        return sum(part.size for part in self.slices)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(part.nbytes for part in self.slices)
+
+    def _add_slice(self) -> bool:
+        growth = pow(2, len(self.slices))
+        part = BloomFilter(self.initial_capacity * growth, self.false_positive_acceptance / MAX_SLICES,
+                           self.base_size * growth)
+        if self.budget is not None and not self.budget.reserve(part.nbytes) and self.slices:
+            return False
+        self.slices.append(part)
+        return True
+
+    def _insert(self, items: list, pairs: numpy.ndarray) -> None:
+        start = 0
+        while start < len(items):
+            last = self.slices[-1]
+            room = last.capacity - last.count
+            if room <= 0 and self._add_slice():
+                continue
+            end = len(items) if room <= 0 else min(len(items), start + room)
+            last.add_many(items[start:end], pairs[start:end])
+            start = end
+
+    def check(self, item: object) -> bool:
+        if not self.slices:
+            return True
+        pair = BloomFilter.hash_pair(item)
+        return any(part.check_pair(pair) for part in self.slices)
+
+    def check_many(self, items: list, pairs: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Checks many items at once
+        :param items: the items to check
+        :param pairs: optional, the already computed hash pairs of the items
+        :return: a boolean array, True for every item that is probably contained
+        """
+        return self.check_pairs(BloomFilter.hash_pairs(items) if pairs is None else pairs)
+
+    def check_pairs(self, pairs: numpy.ndarray) -> numpy.ndarray:
+        """
+        Checks items by their hash pairs alone, e.g. pairs that were computed in another process. Like every check
+        of a bloom filter it never misses an item that was added.
+        :param pairs: the hash pairs of the items
+        :return: a boolean array, True for every item that is probably contained
+        """
+        if not self.slices:
+            return numpy.ones(len(pairs), dtype=bool)
+        contained = numpy.zeros(len(pairs), dtype=bool)
+        # the slices share their hash functions, the mixed hashes are computed once
+        mixed = {}
+        for part in self.slices:
+            if part.hash_functions not in mixed:
+                mixed[part.hash_functions] = BloomFilter.mix_many(pairs, part.hash_functions)
+            contained |= part.check_many(pairs, pairs, mixed[part.hash_functions])
+        return contained
+
+    def add(self, item: object, checked: bool = False):
+        if not self.slices or (not checked and self.check(item)):
+            return
+        last = self.slices[-1]
+        if last.count >= last.capacity and self._add_slice():
+            last = self.slices[-1]
+        last.add_pair(BloomFilter.hash_pair(item))
+
+    def add_many(self, items: list, pairs: numpy.ndarray = None) -> None:
+        """
+        Adds many items at once
+        :param items: the items to add
+        :param pairs: optional, the already computed hash pairs of the items
+        """
+        if not self.slices or not items:
+            return
+        self._insert(items, BloomFilter.hash_pairs(items) if pairs is None else pairs)
+
+    def check_and_add_many(self, items: list, pairs: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Checks and adds many items at once. An item also counts as contained if it appears earlier in the same batch.
+        Only the new items are added, so the slices fill with distinct items.
+        :param items: the items to check and add
+        :param pairs: optional, the already computed hash pairs of the items
+        :return: a boolean array, True for every item that was probably contained before
+        """
+        if not self.slices:
+            return numpy.ones(len(items), dtype=bool)
+        if pairs is None:
+            pairs = BloomFilter.hash_pairs(items)
+        contained = self.check_many(items, pairs)
+        _, first = numpy.unique(pairs, axis=0, return_index=True)
+        repeated = numpy.ones(len(items), dtype=bool)
+        repeated[first] = False
+        contained |= repeated
+        new = numpy.flatnonzero(~contained)
+        if len(new) > 0:
+            self._insert([items[idx] for idx in new], pairs[new])
+        return contained
+
+    def union(self, other: ScalableBloomFilter) -> ScalableBloomFilter:
+        """
+        Combines two filters, the slices of both are kept side by side. The slices are checked independently, so
+        the filters don't need to have the same sizes.
+        :param other: the other filter
+        :return: a new filter that contains the items of both
+        """
+        merged = copy.copy(self)
+        merged.slices = self.slices + other.slices
+        return merged
 
     def __contains__(self, item):
         return self.check(item)
@@ -1,28 +1,46 @@
+from __future__ import annotations
+
 from typing import Any
-from ...helpers.types.bloom_filter import BloomFilter
+
+import numpy
+
+from ...helpers.types.bloom_filter import BloomFilter, MemoryBudget, ScalableBloomFilter
 from ...helpers.types.data_type import Datatype
+from ...helpers.types.hyperloglog import HyperLogLog
+
+VALUE_BATCH_SIZE = 4096
 
 
 class ColumnInfo:
-    values: BloomFilter
+    values: ScalableBloomFilter
+    distinct: HyperLogLog
+    total: int
+    exact_distinct: int
     unique: bool
     is_table: bool
     is_list: bool
     path: list
     data_type: Datatype
     length: int
+    pending: list
+    hashes: list[numpy.ndarray]
 
     def __init__(self, expected_values: int, is_table: bool = False, is_list: bool = False,
                  false_positive_acceptance: int = 0.000000001, path: list = None, datatype: Datatype = None,
-                 length: int = None):
+                 length: int = None, budget: MemoryBudget = None, keep_hashes: bool = False):
         self.path = path
-        self.values = BloomFilter(expected_values, false_positive_acceptance)
+        self.values = ScalableBloomFilter(expected_values, false_positive_acceptance, budget)
+        self.distinct = HyperLogLog()
+        self.total = 0
+        self.exact_distinct = None
         self.unique = True
         self.is_table = is_table
         self.is_list = is_list
         self.data_type = Datatype.BOOLEAN if not datatype else datatype
         self.length = 0 if not length else length
         self.locked = False
+        self.pending = []
+        self.hashes = [] if keep_hashes else None
 
     def get_data_type(self) -> str:
         return self.data_type.name
@@ -38,18 +56,126 @@ class ColumnInfo:
             return Datatype.TEXT
         return Datatype.NOT_ADAPTABLE
 
-    def add_value(self, value) -> bool:
+    def update_type(self, value: Any) -> None:
         data_type = self.calculate_type(value)
         if data_type.value > self.data_type.value:
             self.data_type = data_type
         if data_type == Datatype.TEXT:
             stringified_value = str(value)
             self.length = max(self.length, len(stringified_value))
+
+    def queue_value(self, value: Any, digest: Any = None) -> bool:
+        """
+        Queues the value for the next batch update of the bloom filter, the type is updated right away
+        :param value: the value of the column
+        :param digest: optional, the value that represents it in the filters, e.g. the digest of a subdocument
+        :return: True if the queue is full and should be flushed
+        """
+        self.update_type(value)
+        self.pending.append(value if digest is None else digest)
+        return len(self.pending) >= VALUE_BATCH_SIZE
+
+    def flush_values(self) -> bool:
+        """
+        Adds the queued values to the bloom filter in one batch. If the column keeps hashes, the hash pairs of the
+        values are kept while the column is unique, merge checks them against the filter of another part.
+        :return: True if a queued value was seen before and the column is not locked
+        """
+        if not self.pending:
+            return False
+        values, self.pending = self.pending, []
+        pairs = BloomFilter.hash_pairs(values)
+        self.distinct.add_hashes(pairs[:, 0])
+        self.total += len(values)
+        if self.locked:
+            self.values.add_many(values, pairs)
+            self._keep_hashes(pairs)
+            return False
+        if self.values.check_and_add_many(values, pairs).any():
+            self.unique = False
+            self._drop_hashes()
+            return True
+        if self.unique:
+            self._keep_hashes(pairs)
+        return False
+
+    def _keep_hashes(self, pairs: numpy.ndarray) -> None:
+        if self.hashes is None:
+            return
+        self.hashes.append(pairs)
+        if self.values.budget is not None:
+            self.values.budget.charge(pairs.nbytes)
+
+    def _drop_hashes(self) -> None:
+        if not self.hashes:
+            return
+        if self.values.budget is not None:
+            self.values.budget.release(sum(pairs.nbytes for pairs in self.hashes))
+        self.hashes = []
+
+    def add_value(self, value, digest: Any = None) -> bool:
+        self.update_type(value)
+        if digest is not None:
+            value = digest
+        self.distinct.add(value)
+        self.total += 1
         if not self.locked and value in self.values:
             self.unique = False
             return True
         self.values.add(value, checked=True)
         return False
 
+    def merge(self, other: ColumnInfo) -> ColumnInfo:
+        """
+        Merges the statistics of the same column collected from another part of the collection. Values that appear
+        in both parts make the column non-unique. The hash pairs of the other part are checked against the filter
+        of this part, a bloom filter never misses an added value, so a common value is always found. False positives
+        can only make a unique column non-unique.
+        :param other: the column info of the other part, both need to be flushed and keep hashes
+        :return: this column info containing the statistics of both parts
+        """
+        unique = self.unique and other.unique
+        if unique and other.hashes:
+            unique = not self.values.check_pairs(numpy.concatenate(other.hashes)).any()
+        self.values = self.values.union(other.values)
+        self.unique = unique
+        if self.hashes is not None and other.hashes is not None:
+            self.hashes = self.hashes + other.hashes if unique else []
+        self.locked = self.locked or other.locked
+        self.is_table = self.is_table or other.is_table
+        self.is_list = self.is_list or other.is_list
+        if other.data_type.value > self.data_type.value:
+            self.data_type = other.data_type
+        self.length = max(self.length, other.length)
+        self.distinct.merge(other.distinct)
+        self.total += other.total
+        self.exact_distinct = None
+        return self
+
+    def set_counts(self, distinct: int, total: int) -> None:
+        """
+        Sets exactly counted statistics, e.g. counted by mongo, they replace the estimate of the sketch
+        :param distinct: the number of distinct values
+        :param total: the number of values
+        """
+        self.exact_distinct = distinct
+        self.total = total
+
+    def cardinality(self) -> int:
+        """
+        :return: the (estimated) number of distinct values of the column
+        """
+        if self.exact_distinct is not None:
+            return self.exact_distinct
+        return self.distinct.count()
+
+    def distinct_ratio(self) -> float:
+        """
+        :return: the share of distinct values among all values, 1.0 if every value is distinct
+        """
+        if self.total == 0:
+            return 1.0
+        return min(self.cardinality() / self.total, 1.0)
+
     def __contains__(self, item):
         return item in self.values
@@ -0,0 +1,194 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the row buffer that collects the rows of a target table until they are written.
+"""
+import sys
+from collections.abc import Iterator
+
+import pandas as pd
+
+from .seen_keys import SeenKeys, ExistingKeys
+from .spill_file import SpillFile
+
+SLOT_SIZE = 8
+
+
+class RowBuffer:
+    """
+    Collects the rows of one target table in preallocated column lists. Appending a row costs the same no matter how
+    many rows are already buffered, a dataframe is only built when the buffer is written.
+    Optionally the approximate memory of the buffered values is tracked. Rows can be moved to spill files on the
+    disk, the length of the buffer counts the spilled rows as well.
+    """
+    columns: list[str]
+    pks: list[str]
+    capacity: int
+    size: int
+    track_size: bool
+    nbytes: int
+    spilled: list[SpillFile]
+    seen_keys: SeenKeys
+    existing_keys: ExistingKeys
+    _values: list[list]
+    _pk_positions: list[int]
+
+    def __init__(self, columns: list[str], capacity: int = 1024, pks: list[str] = None, seen_capacity: int = 0,
+                 existing_keys: ExistingKeys = None, track_size: bool = False):
+        """
+        Preallocates the column lists
+        :param columns: the names of the columns in the order the rows are given
+        :param capacity: the number of rows that fit into the buffer before it has to grow
+        :param pks: optional, the primary key columns of the table
+        :param seen_capacity: optional, the number of primary keys remembered to drop rows whose key was already
+        buffered, 0 disables it
+        :param existing_keys: optional, the primary keys that already exist in the target table, their rows are
+        dropped
+        :param track_size: if True the approximate number of bytes of the buffered values is kept in nbytes
+        """
+        self.columns = list(columns)
+        self.pks = list(pks) if pks else []
+        self.capacity = max(capacity, 1)
+        self.size = 0
+        self.track_size = track_size
+        self.nbytes = 0
+        self.spilled = []
+        self._values = [[None] * self.capacity for _ in self.columns]
+        self._pk_positions = [self.columns.index(pk) for pk in self.pks if pk in self.columns]
+        has_keys = bool(self._pk_positions) and len(self._pk_positions) == len(self.pks)
+        self.seen_keys = SeenKeys(seen_capacity) if seen_capacity > 0 and has_keys else None
+        self.existing_keys = existing_keys if has_keys else None
+
+    def __len__(self):
+        return self.size + sum(len(spill_file) for spill_file in self.spilled)
+
+    def _grow(self) -> None:
+        """
+        Doubles the capacity of all the column lists
+        """
+        for values in self._values:
+            values.extend([None] * self.capacity)
+        self.capacity *= 2
+
+    def append(self, row: tuple) -> None:
+        """
+        Appends a single row to the buffer
+        :param row: the values of the row in the order of the columns
+        """
+        if self.size == self.capacity:
+            self._grow()
+        for values, value in zip(self._values, row):
+            values[self.size] = value
+        self.size += 1
+        if self.track_size:
+            # shared objects like small ints are counted for every row, the estimate errs on the safe side
+            self.nbytes += sum(sys.getsizeof(value) for value in row) + SLOT_SIZE * len(row)
+
+    def extend(self, rows: list[tuple]) -> int:
+        """
+        Appends multiple rows to the buffer. Rows whose primary key was already buffered or already exists in the
+        target table are dropped if these keys are tracked.
+        :param rows: the rows in the order of the columns
+        :return: the number of appended rows
+        """
+        if self.seen_keys is None and self.existing_keys is None:
+            for row in rows:
+                self.append(row)
+            return len(rows)
+        appended = 0
+        for row in rows:
+            key = tuple(row[position] for position in self._pk_positions)
+            if self.existing_keys is not None and key in self.existing_keys:
+                continue
+            if self.seen_keys is not None and self.seen_keys.check_and_add(key):
+                continue
+            self.append(row)
+            appended += 1
+        return appended
+
+    def get_column(self, name: str) -> list:
+        """
+        Returns the buffered values of a column
+        :param name: the name of the column
+        :return: a copy of the buffered values
+        """
+        return self._values[self.columns.index(name)][:self.size]
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        Iterates over the buffered rows
+        :return: yields the rows as tuples in the order of the columns
+        """
+        return zip(*(values[:self.size] for values in self._values))
+
+    def sort_by_keys(self) -> None:
+        """
+        Sorts the buffered rows by their primary key. Parallel writers that insert overlapping keys in the same order
+        can't deadlock each other. The values are compared by their string representation, the order only has to be
+        the same in every process.
+        """
+        if not self.pks or self.size < 2:
+            return
+        ordered = sorted(self.rows(), key=lambda row: tuple(str(row[position]) for position in self._pk_positions))
+        for idx, row in enumerate(ordered):
+            for values, value in zip(self._values, row):
+                values[idx] = value
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Materializes the buffered rows as a dataframe. The values are kept as python objects, just like the values
+        that were read from the documents.
+        :return: the dataframe containing all buffered rows
+        """
+        return pd.DataFrame({name: values[:self.size] for name, values in zip(self.columns, self._values)},
+                            columns=self.columns, dtype=object)
+
+    def clear(self) -> None:
+        """
+        Empties the buffer. The allocated column lists are kept and reused for the next rows. Spilled rows are not
+        touched, they are taken out with take_spilled.
+        """
+        for values in self._values:
+            values[:self.size] = [None] * self.size
+        self.size = 0
+        self.nbytes = 0
+
+    def spill(self, directory: str = None) -> None:
+        """
+        Moves the buffered rows to a compressed spill file and empties the buffer
+        :param directory: optional, the directory of the spill file
+        """
+        if self.size == 0:
+            return
+        self.spilled.append(SpillFile(self.columns, [values[:self.size] for values in self._values], directory))
+        self.clear()
+
+    def take_spilled(self) -> list[SpillFile]:
+        """
+        Takes the spill files out of the buffer, the rows are read back when they are written
+        :return: the spill files in the order they were written
+        """
+        spilled = self.spilled
+        self.spilled = []
+        return spilled
+
+    def drop_spilled(self) -> None:
+        """
+        Deletes the spill files whose rows were not written, e.g. after a failed transfer
+        """
+        for spill_file in self.take_spilled():
+            spill_file.delete()
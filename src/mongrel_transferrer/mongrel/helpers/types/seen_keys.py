@@ -0,0 +1,96 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the indexes of the primary keys that were already extracted during a transfer or that already exist in the
+target database.
+"""
+from collections import OrderedDict
+
+KEY_SEPARATOR = "\x00"
+
+
+class SeenKeys:
+    """
+    Remembers the most recently seen primary keys of a table. The keys are stored exactly, so a key is only reported
+    as seen if it really was. When the index is full the least recently seen key is evicted, an evicted key is simply
+    written again and dropped by the database.
+    """
+    capacity: int
+    _keys: OrderedDict
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: the maximum number of keys that are remembered
+        """
+        self.capacity = capacity
+        self._keys = OrderedDict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def check_and_add(self, key: tuple) -> bool:
+        """
+        Checks if the key was seen before and remembers it
+        :param key: the primary key values of a row
+        :return: True if the key was seen before
+        """
+        try:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                return True
+        except TypeError:
+            # unhashable keys are never dropped
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.capacity:
+            self._keys.popitem(last=False)
+        return False
+
+
+class ExistingKeys:
+    """
+    The primary keys that already exist in a target table. The database returns typed values while the extracted
+    values may still be strings, so the keys are compared by the string representation of their values. A table can
+    hold millions of keys, they are packed into one bytes object each instead of a tuple of strings.
+    """
+    _keys: set[bytes]
+
+    def __init__(self):
+        self._keys = set()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key: tuple) -> bool:
+        return ExistingKeys.normalize(key) in self._keys
+
+    @staticmethod
+    def normalize(key: tuple) -> bytes:
+        """
+        Turns a key into the bytes it is stored as
+        :param key: the primary key values of a row
+        :return: the utf-8 encoded string representations of the values, separated by NUL which postgres does not
+        allow in text values
+        """
+        return KEY_SEPARATOR.join(str(value) for value in key).encode("utf-8", "surrogatepass")
+
+    def add(self, key: tuple) -> None:
+        """
+        Adds a key of the target table
+        :param key: the primary key values of a row
+        """
+        self._keys.add(ExistingKeys.normalize(key))
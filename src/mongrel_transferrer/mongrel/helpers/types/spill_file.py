@@ -0,0 +1,73 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the spill files that move buffered rows out of memory until their table can be written.
+"""
+import gzip
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+
+SPILL_COMPRESSION_LEVEL = 1
+
+
+class SpillFile:
+    """
+    The rows of a buffer that were written to a compressed temporary file on the local disk. The file is read back
+    when the rows are written to the target database and deleted afterwards.
+    """
+    path: str
+    columns: list[str]
+    rows: int
+
+    def __init__(self, columns: list[str], values: list[list], directory: str = None):
+        """
+        Writes the column lists to a new temporary file
+        :param columns: the names of the columns
+        :param values: the values of every column, all lists have the same length
+        :param directory: optional, the directory of the file, defaults to the temporary directory of the system
+        """
+        self.columns = list(columns)
+        self.rows = len(values[0]) if values else 0
+        handle, self.path = tempfile.mkstemp(prefix="mongrel_", suffix=".pkl.gz", dir=directory)
+        with os.fdopen(handle, "wb") as raw, \
+                gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=SPILL_COMPRESSION_LEVEL) as file:
+            pickle.dump(values, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return self.rows
+
+    def read(self) -> pd.DataFrame:
+        """
+        Reads the rows back and deletes the file
+        :return: the dataframe of the rows, the values are kept as python objects like in the buffer
+        """
+        with gzip.open(self.path, "rb") as file:
+            values = pickle.load(file)
+        self.delete()
+        return pd.DataFrame(dict(zip(self.columns, values)), columns=self.columns, dtype=object)
+
+    def delete(self) -> None:
+        """
+        Removes the file from the disk, it may already be gone
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,205 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the follower that tails the change stream of the source collection after a transfer.
+"""
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+
+from .checkpoint import Checkpoint
+from .extraction_plan import ExtractionPlan, SharedExtractionPlan
+from .table import TableInfo
+from ..helpers.database_functions import delete_by_keys
+from ..helpers.types.row_buffer import RowBuffer
+
+if TYPE_CHECKING:
+    from .transferrer import Transferrer
+
+CHANGE_STREAM_SUFFIX = "~changes"
+UPSERT_OPERATIONS = ("insert", "update", "replace")
+
+
+class ChangeStreamFollower:
+    """
+    Applies the changes of the source collection to the target tables of a transfer
+    """
+    transferrer: Transferrer
+
+    def __init__(self, transferrer: Transferrer):
+        """
+        :param transferrer: the transferrer whose relations, buffers and sink are used
+        """
+        self.transferrer = transferrer
+
+    def get_root_tables(self) -> list[TableInfo]:
+        """
+        Finds the tables whose rows stand for the source documents themselves, i.e. the tables that are not
+        referenced by any other table except by the n:m helper tables they own
+        :return: the buffer lookups of the root tables
+        """
+        referenced = set()
+        for relation in self.transferrer.relations:
+            for column in relation.columns:
+                if column.foreign_reference is not None and column.foreign_reference != relation.nm_parent:
+                    referenced.add(column.foreign_reference)
+        roots = []
+        for relation in self.transferrer.relations:
+            relation_info = relation.info if not relation.alias else relation.alias
+            if not relation.nm_helper and relation_info not in referenced and relation_info not in roots:
+                roots.append(relation_info)
+        return roots
+
+    def delete_rows(self, relation_info: TableInfo, keys: set[tuple], connection: object) -> None:
+        """
+        Deletes rows of a table together with all n:m helper rows referencing them
+        :param relation_info: the table the rows are deleted from
+        :param keys: the primary keys of the rows, in the order of the primary key columns
+        :param connection: the connection to the target database
+        """
+        pks = self.transferrer.primary_keys[relation_info]
+        for helper in self.transferrer.relations:
+            if not helper.nm_helper:
+                continue
+            reference_keys = helper.get_reference_keys(relation_info)
+            if reference_keys:
+                helper_columns = list(reference_keys.keys())
+                positions = [pks.index(reference_keys[name]) for name in helper_columns]
+                delete_by_keys(connection, helper.info.table, helper.info.schema, helper_columns,
+                               {tuple(key[position] for position in positions) for key in keys})
+        delete_by_keys(connection, relation_info.table, relation_info.schema, pks, keys)
+
+    def buffer_change(self, change: dict, data: dict[TableInfo, RowBuffer], deletes: dict[TableInfo, set[tuple]],
+                      plans: list[tuple[TableInfo, ExtractionPlan]], shared_plan: SharedExtractionPlan,
+                      root_plans: list[tuple[TableInfo, ExtractionPlan]]) -> int:
+        """
+        Extracts the rows of a change stream event. Upserted documents are added to the buffers, the primary keys
+        of the root rows of deleted documents are collected.
+        :param change: the change stream event
+        :param data: the buffers of all relations
+        :param deletes: the primary keys of the deleted rows of the root tables
+        :param plans: the extraction plans of all relations
+        :param shared_plan: optional, the combined plan that walks every document only once
+        :param root_plans: the extraction plans of the root tables
+        :return: the number of rows the event added
+        """
+        rows = 0
+        operation = change.get("operationType")
+        if operation in UPSERT_OPERATIONS and change.get("fullDocument") is not None:
+            for (relation_info, _), extracted in zip(plans, self.transferrer.extract_rows(change["fullDocument"],
+                                                                                          plans, shared_plan)):
+                data[relation_info].extend(extracted)
+                rows += len(extracted)
+        elif operation == "delete":
+            doc = change.get("fullDocumentBeforeChange") or change.get("documentKey", {})
+            for relation_info, plan in root_plans:
+                positions = [data[relation_info].columns.index(pk)
+                             for pk in self.transferrer.primary_keys[relation_info]]
+                for row in plan.extract(doc):
+                    deletes.setdefault(relation_info, set()).add(tuple(row[position] for position in positions))
+                    rows += 1
+        return rows
+
+    def apply_changes(self, data: dict[TableInfo, RowBuffer], deletes: dict[TableInfo, set[tuple]],
+                      checkpoint: Checkpoint, connection: object) -> None:
+        """
+        Writes a micro-batch of the change stream. The buffered rows are upserted before the deleted rows are
+        removed, afterwards the resume token is stored if there is one.
+        :param data: the buffers of all relations
+        :param deletes: the primary keys of the deleted rows of the root tables
+        :param checkpoint: the checkpoint containing the resume token after the micro-batch
+        :param connection: the connection to the target database
+        """
+        transferrer = self.transferrer
+        transferrer.write_batches(transferrer.collect_batches(transferrer.scheduler.order, data), connection)
+        for relation_info, keys in deletes.items():
+            self.delete_rows(relation_info, keys, connection)
+        connection.commit()
+        deletes.clear()
+        if checkpoint.has_watermark:
+            transferrer.checkpoint_store.save(connection, checkpoint)
+
+    def follow(self, initial_transfer: bool = True) -> None:
+        """
+        Tails the change stream of the collection and applies the changes in micro-batches. A micro-batch is written
+        as soon as it holds max_batch_rows rows or its first change is max_latency_ms old, both are taken from the
+        checkpoint options. Inserted, replaced and updated documents are upserted, deleted documents remove the rows
+        of the root tables and their n:m helper rows. The rows of a deleted document are extracted from its
+        pre-image, without pre-images enabled on the collection only root tables keyed by _id can be cleaned up.
+        The resume token is stored with every micro-batch, a restart continues after the last written one. Without
+        a stored token the stream is opened first and the whole collection is transferred, so no change is missed.
+        The first token is only stored once this transfer is finished.
+        Runs until the change stream is closed.
+        :param initial_transfer: if True the collection is transferred when no resume token is stored
+        """
+        transferrer = self.transferrer
+        if not transferrer.sink.is_database:
+            raise ValueError("Following the changes needs a database sink")
+        transferrer.upsert = True
+        options = transferrer.options.checkpoint
+        max_batch_rows = options.max_batch_rows if options.max_batch_rows else transferrer.options.write.batch_size
+        name = f'{transferrer.checkpoint_name}{CHANGE_STREAM_SUFFIX}'
+        mongo_client = transferrer.create_mongo_client()
+        collie = mongo_client[transferrer.mongo_database][transferrer.mongo_collection]
+        data: dict[TableInfo, RowBuffer] = transferrer.create_data_dict()
+        plans = transferrer.create_extraction_plans(data)
+        shared_plan = SharedExtractionPlan([plan for _, plan in plans]) \
+            if transferrer.options.read.shared_traversal else None
+        roots = self.get_root_tables()
+        root_plans = [(relation_info, plan) for relation_info, plan in plans if relation_info in roots]
+        engine_go_brr = transferrer.create_sql_engine()
+        with engine_go_brr.connect() as connie:
+            transferrer.checkpoint_store.prepare(connie)
+            stored = transferrer.checkpoint_store.load(connie, name)
+            token = stored.watermark if stored is not None and stored.has_watermark else None
+            with collie.watch(full_document="updateLookup", full_document_before_change="whenAvailable",
+                              resume_after=token, max_await_time_ms=options.max_latency_ms) as stream:
+                if token is None:
+                    token = stream.resume_token
+                    if initial_transfer:
+                        transferrer.transfer_data()
+                    # only stored now, a failed initial transfer is repeated after a restart
+                    if token is not None:
+                        transferrer.checkpoint_store.save(connie, Checkpoint(name, watermark=token, has_watermark=True))
+                deletes: dict[TableInfo, set[tuple]] = {}
+                rows = 0
+                started = None
+                while stream.alive:
+                    change = stream.try_next()
+                    if change is not None:
+                        if deletes and change.get("operationType") in UPSERT_OPERATIONS:
+                            # the rows of a deleted document may be inserted again, the deletes go first
+                            self.apply_changes(data, deletes, Checkpoint(name, watermark=token,
+                                                                         has_watermark=token is not None), connie)
+                            rows = 0
+                            started = None
+                        rows += self.buffer_change(change, data, deletes, plans, shared_plan, root_plans)
+                        if started is None and rows > 0:
+                            started = time.monotonic()
+                    token = stream.resume_token
+                    if started is not None and (rows >= max_batch_rows
+                                                or (time.monotonic() - started) * 1000 >= options.max_latency_ms):
+                        self.apply_changes(data, deletes, Checkpoint(name, watermark=token,
+                                                                     has_watermark=token is not None), connie)
+                        rows = 0
+                        started = None
+                if started is not None:
+                    self.apply_changes(data, deletes, Checkpoint(name, watermark=token,
+                                                                 has_watermark=token is not None), connie)
+        engine_go_brr.dispose()
+        mongo_client.close()
@@ -0,0 +1,233 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the checkpoints that make transfers resumable. The checkpoints are stored in a small state table in the
+target database.
+"""
+import json
+
+from bson import json_util
+from sqlalchemy import Connection, text
+
+from .table import TableInfo
+from ..helpers.database_functions import quote_identifier
+
+CHECKPOINT_TABLE = "mongrel_checkpoints"
+PARTITION_SEP = "#"
+
+
+class Checkpoint:
+    """
+    The stored state of a transfer or of one partition of a transfer
+    """
+    name: str
+    query: dict
+    field: str
+    inclusive: bool
+    watermark: object
+    has_watermark: bool
+    finished: bool
+    tables: dict
+
+    def __init__(self, name: str, query: dict = None, watermark: object = None, has_watermark: bool = False,
+                 finished: bool = False, tables: dict = None, field: str = "_id", inclusive: bool = False):
+        """
+        :param name: the name of the transfer, partitions are named transfer#index
+        :param query: the query selecting the documents of the transfer
+        :param watermark: every document up to this value of the field is completely written
+        :param has_watermark: False if no document is completely written yet
+        :param finished: True if the transfer is complete
+        :param tables: the flush state of every table
+        :param field: the field the documents are ordered by, _id or the watermark field of incremental transfers
+        :param inclusive: if True the documents at the watermark are read again when resuming
+        """
+        self.name = name
+        self.query = query if query else {}
+        self.field = field
+        self.inclusive = inclusive
+        self.watermark = watermark
+        self.has_watermark = has_watermark
+        self.finished = finished
+        self.tables = tables if tables else {}
+
+    def resume_query(self) -> dict:
+        """
+        Builds the query that selects all documents that are not completely written yet
+        :return: the query for the source collection
+        """
+        if not self.has_watermark:
+            return self.query
+        after = {self.field: {"$gte" if self.inclusive else "$gt": self.watermark}}
+        if not self.query:
+            return after
+        return {"$and": [self.query, after]}
+
+
+class CheckpointStore:
+    """
+    Reads and writes the checkpoints in the state table of the target database
+    """
+    table: str
+
+    def __init__(self, table: str = CHECKPOINT_TABLE):
+        """
+        :param table: the name of the state table
+        """
+        self.table = quote_identifier(table)
+
+    def prepare(self, connection: Connection) -> None:
+        """
+        Creates the state table if it does not exist yet
+        :param connection: the connection to the target database
+        """
+        connection.execute(text(f'CREATE TABLE IF NOT EXISTS {self.table}(\n'
+                                '\t"name" TEXT PRIMARY KEY,\n'
+                                '\t"query" TEXT,\n'
+                                '\t"watermark" TEXT,\n'
+                                '\t"finished" BOOLEAN NOT NULL DEFAULT FALSE,\n'
+                                '\t"tables" TEXT,\n'
+                                '\t"updated_at" TIMESTAMP NOT NULL DEFAULT now()\n'
+                                ')'))
+        connection.commit()
+
+    def save(self, connection: Connection, checkpoint: Checkpoint) -> None:
+        """
+        Stores the checkpoint, replacing the previous one of the same name
+        :param connection: the connection to the target database
+        :param checkpoint: the checkpoint to store
+        """
+        connection.execute(text(f'INSERT INTO {self.table} ("name", "query", "watermark", "finished", "tables") '
+                                'VALUES (:name, :query, :watermark, :finished, :tables) '
+                                'ON CONFLICT ("name") DO UPDATE SET "query" = EXCLUDED."query", '
+                                '"watermark" = EXCLUDED."watermark", "finished" = EXCLUDED."finished", '
+                                '"tables" = EXCLUDED."tables", "updated_at" = now()'),
+                           {"name": checkpoint.name, "query": json_util.dumps(checkpoint.query),
+                            "watermark": json_util.dumps({"value": checkpoint.watermark})
+                            if checkpoint.has_watermark else None,
+                            "finished": checkpoint.finished, "tables": json.dumps(checkpoint.tables)})
+        connection.commit()
+
+    @staticmethod
+    def _parse(row) -> Checkpoint:
+        watermark = json_util.loads(row[2])["value"] if row[2] is not None else None
+        return Checkpoint(row[0], json_util.loads(row[1]) if row[1] else {}, watermark, row[2] is not None,
+                          row[3], json.loads(row[4]) if row[4] else {})
+
+    def load(self, connection: Connection, name: str) -> Checkpoint:
+        """
+        Loads a checkpoint
+        :param connection: the connection to the target database
+        :param name: the name of the transfer
+        :return: the checkpoint or None if there is none
+        """
+        result = connection.execute(text(f'SELECT "name", "query", "watermark", "finished", "tables" FROM {self.table} '
+                                         'WHERE "name" = :name'), {"name": name}).fetchone()
+        connection.commit()
+        return CheckpointStore._parse(result) if result else None
+
+    def load_partitions(self, connection: Connection, name: str) -> list[Checkpoint]:
+        """
+        Loads the checkpoints of all partitions of a parallel transfer
+        :param connection: the connection to the target database
+        :param name: the name of the transfer
+        :return: the checkpoints of the partitions
+        """
+        result = connection.execute(text(f'SELECT "name", "query", "watermark", "finished", "tables" FROM {self.table} '
+                                         'WHERE starts_with("name", :prefix) ORDER BY "name"'),
+                                    {"prefix": name + PARTITION_SEP}).fetchall()
+        connection.commit()
+        return [CheckpointStore._parse(row) for row in result]
+
+    def clear(self, connection: Connection, name: str) -> None:
+        """
+        Deletes the checkpoints of a transfer and of all its partitions
+        :param connection: the connection to the target database
+        :param name: the name of the transfer
+        """
+        connection.execute(text(f'DELETE FROM {self.table} WHERE "name" = :name OR starts_with("name", :prefix)'),
+                           {"name": name, "prefix": name + PARTITION_SEP})
+        connection.commit()
+
+
+class TransferProgress:
+    """
+    Tracks which documents are completely written during a transfer. The documents are read in the order of the
+    checkpoint's field. A buffer that receives its first rows remembers the value of the document before, every
+    document up to the earliest remembered value is completely written.
+    """
+    checkpoint: Checkpoint
+    path: list[str]
+    last_id: object
+    has_last_id: bool
+    pending: dict[TableInfo, tuple[bool, object]]
+    written: dict[TableInfo, int]
+
+    def __init__(self, checkpoint: Checkpoint):
+        """
+        :param checkpoint: the checkpoint the transfer starts from
+        """
+        self.checkpoint = checkpoint
+        self.path = checkpoint.field.split(".")
+        self.last_id = checkpoint.watermark
+        self.has_last_id = checkpoint.has_watermark
+        self.pending = {}
+        self.written = {TableInfo(name): state.get("written", 0) for name, state in checkpoint.tables.items()}
+
+    def mark_buffered(self, relation_info: TableInfo) -> None:
+        """
+        Called when a buffer receives rows while it was empty
+        :param relation_info: the table of the buffer
+        """
+        if relation_info not in self.pending:
+            self.pending[relation_info] = (self.has_last_id, self.last_id)
+
+    def mark_document(self, doc: dict) -> None:
+        """
+        Called when all rows of a document are buffered, a dotted field is looked up in the embedded documents
+        :param doc: the source document
+        """
+        value = doc
+        for key in self.path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value is not None:
+            self.last_id = value
+            self.has_last_id = True
+
+    def mark_flushed(self, relation_info: TableInfo, rows: int) -> None:
+        """
+        Called when the rows of a buffer are taken out to be written
+        :param relation_info: the table of the buffer
+        :param rows: the number of rows taken out
+        """
+        self.pending.pop(relation_info, None)
+        self.written[relation_info] = self.written.get(relation_info, 0) + rows
+
+    def snapshot(self, buffered: dict[TableInfo, int], finished: bool = False) -> Checkpoint:
+        """
+        Creates the checkpoint of the current state. It is only valid once all rows taken out so far are written.
+        :param buffered: the number of rows in every buffer
+        :param finished: True if all documents are written
+        :return: the checkpoint
+        """
+        has_watermark, watermark = self.has_last_id, self.last_id
+        if self.pending:
+            # the buffers are marked in document order, the first one is the earliest
+            has_watermark, watermark = next(iter(self.pending.values()))
+        tables = {str(info): {"written": self.written.get(info, 0), "buffered": rows}
+                  for info, rows in buffered.items()}
+        return Checkpoint(self.checkpoint.name, self.checkpoint.query, watermark, has_watermark, finished, tables,
+                          self.checkpoint.field, self.checkpoint.inclusive)
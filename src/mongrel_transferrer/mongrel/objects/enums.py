@@ -37,3 +37,19 @@ class ConflictHandling(Enum):
     """
     DROP previous tables with the same schema and table name as the target tables
     """
+
+
+class WriteMethod(Enum):
+    """
+    This enum describes how the batches are written to the target database. Both keep the ON CONFLICT DO NOTHING
+    behaviour.
+    """
+    INSERT = 1
+    """
+    INSERT writes every batch as one multi-row INSERT statement built by sqlalchemy.
+    """
+    COPY = 2
+    """
+    COPY streams every batch into a temporary staging table and merges it into the target table afterwards.
+    Considerably faster for big batches.
+    """
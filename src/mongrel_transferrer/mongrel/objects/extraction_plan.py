@@ -0,0 +1,288 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the extraction plans that read the rows of a table directly out of the source documents.
+"""
+from __future__ import annotations
+
+from .table import Table, Field
+from ..helpers.conversions import Conversions, CachedConversion
+from ..helpers.exceptions import FanOutLimitException
+
+
+def check_fan_out(count: int, fan_out_limit: int = None) -> None:
+    """
+    Stops the extraction of a document that fans out into too many rows. The number of partial rows only grows while
+    a document is walked, so the check is done before a product is built and not after.
+    :param count: the number of partial rows that is about to be built
+    :param fan_out_limit: optional, the maximum number of rows of a table per document
+    """
+    if fan_out_limit is not None and count > fan_out_limit:
+        raise FanOutLimitException(f"{count} rows of a table exceed the fan out limit of {fan_out_limit}. Raise "
+                                   f"the fan_out_limit of the read options or set it to None to disable it.")
+
+
+class PathNode:
+    """
+    A node of the path trie. Every key of a column path is one level of the trie, the columns are stored at the node
+    their path ends in.
+    """
+    children: dict[str, PathNode]
+    columns: list[int]
+
+    def __init__(self):
+        self.children = {}
+        self.columns = []
+
+    def add_path(self, path: list[str], position: int) -> None:
+        """
+        Adds the path of a column to the trie
+        :param path: the path of the column in the source document
+        :param position: the position of the column in the extracted rows
+        """
+        node = self
+        for key in path:
+            node = node.children.setdefault(key, PathNode())
+        node.columns.append(position)
+
+
+class ExtractionPlan:
+    """
+    The extraction plan is compiled once per table. It walks a document along the column paths of the table and
+    returns the rows directly. Lists are fanned out while walking, sibling lists are combined with a cartesian
+    product just like map_flattener.flatten does. Lists of other tables are not part of the trie and never expanded.
+    """
+    relation: Table
+    columns: list[str]
+    root: PathNode
+    pk_positions: list[int]
+    conversions: list[tuple[int, CachedConversion]]
+    fan_out_limit: int
+
+    def __init__(self, relation: Table, columns: list[str] = None, deferred: set[str] = None,
+                 fan_out_limit: int = None):
+        """
+        Compiles the column paths of the table into a trie
+        :param relation: the table to extract the rows for
+        :param columns: optional, the column order of the extracted rows. Columns of the order that are not part of
+        the table are filled with None. Defaults to the columns of the table
+        :param deferred: optional, the columns whose conversion is applied to the whole buffered column before it is
+        written, their values are extracted unconverted
+        :param fan_out_limit: optional, the maximum number of rows extracted from a single document, documents with
+        more rows raise a FanOutLimitException
+        """
+        self.relation = relation
+        self.fan_out_limit = fan_out_limit
+        self.columns = columns if columns is not None else relation.get_column_names()
+        self.root = PathNode()
+        self.pk_positions = []
+        self.conversions = []
+        for col in relation.columns:
+            if not col.path:
+                continue
+            position = self.columns.index(col.target_name)
+            self.root.add_path(col.path, position)
+            if col.field_type == Field.PRIMARY_KEY:
+                self.pk_positions.append(position)
+            if col.conversion_function is not Conversions.do_nothing and \
+                    (deferred is None or col.target_name not in deferred):
+                self.conversions.append((position, col.converter))
+
+    @staticmethod
+    def walk(node: PathNode, value: object, fan_out_limit: int = None) -> list[dict[int, object]]:
+        """
+        Walks a value of the document along the trie
+        :param node: the node of the trie that corresponds to the value
+        :param value: the value within the document
+        :param fan_out_limit: optional, the maximum number of partial rows
+        :return: the partial rows found below the node as dicts of column position and value
+        """
+        if isinstance(value, list):
+            rows = []
+            for item in value:
+                rows.extend(ExtractionPlan.walk(node, item, fan_out_limit))
+                check_fan_out(len(rows), fan_out_limit)
+            return rows
+        if not isinstance(value, dict):
+            return [dict.fromkeys(node.columns, value)]
+        rows = [{}]
+        for key, child in node.children.items():
+            if key in value:
+                found = ExtractionPlan.walk(child, value[key], fan_out_limit)
+                if found:
+                    check_fan_out(len(rows) * len(found), fan_out_limit)
+                    rows = [{**row, **other} for row in rows for other in found]
+        return rows
+
+    def has_roots(self, doc: dict) -> bool:
+        """
+        Checks if any of the top level keys of the column paths are in the document
+        :param doc: the source document
+        :return: True if the document can contain rows for the table
+        """
+        return any(key in doc for key in self.root.children)
+
+    def finish_rows(self, partial_rows: list[dict], positions: dict[int, list[int]] = None) -> list[tuple]:
+        """
+        Turns partial rows into the final rows. Rows that miss a primary key value or have no values at all are
+        dropped, the conversion functions are applied to all other values
+        :param partial_rows: the partial rows found by walk
+        :param positions: optional, the column positions of the keys in the partial rows. If not given the keys are
+        the column positions themselves
+        :return: the rows in the column order of the plan
+        """
+        rows = []
+        width = len(self.columns)
+        for partial in partial_rows:
+            if not partial:
+                continue
+            row = [None] * width
+            if positions is None:
+                for position, value in partial.items():
+                    row[position] = value
+            else:
+                for key, value in partial.items():
+                    for position in positions[key]:
+                        row[position] = value
+            if any(row[position] is None for position in self.pk_positions):
+                continue
+            for position, converter in self.conversions:
+                if row[position] is not None:
+                    row[position] = converter(row[position])
+            if any(value is not None for value in row):
+                rows.append(tuple(row))
+        return rows
+
+    def extract(self, doc: dict) -> list[tuple]:
+        """
+        Extracts all rows of the table from a document
+        :param doc: the source document
+        :return: the rows in the column order of the plan
+        """
+        if not self.has_roots(doc):
+            return []
+        return self.finish_rows(ExtractionPlan.walk(self.root, doc, self.fan_out_limit))
+
+
+class ShapeNode:
+    """
+    A node of the shared trie. A shape describes which paths below a node are read by a table. Tables that read the
+    same paths below a node share the shape and therefore the partial rows that are found for it.
+    """
+    path_id: int
+    children: dict[str, ShapeNode]
+
+    def __init__(self, path_id: int = None):
+        self.path_id = path_id
+        self.children = {}
+
+
+class SharedExtractionPlan:
+    """
+    Combines the extraction plans of all tables. A document is walked only once, every table receives its rows from
+    that walk. The partial rows of a subtree are computed once per shape and reused by all tables with that shape,
+    e.g. a parent table and the n:m helper tables built from it.
+    """
+    plans: list[ExtractionPlan]
+    roots: list[ShapeNode]
+    positions: list[dict[int, list[int]]]
+    fan_out_limit: int
+    _path_ids: dict[tuple, int]
+    _shapes: dict[tuple, ShapeNode]
+
+    def __init__(self, plans: list[ExtractionPlan]):
+        """
+        Compiles the tries of all extraction plans into shared shapes
+        :param plans: the extraction plans of all tables, the smallest fan out limit of the plans applies to all
+        """
+        self.plans = plans
+        limits = [plan.fan_out_limit for plan in plans if plan.fan_out_limit is not None]
+        self.fan_out_limit = min(limits) if limits else None
+        self._path_ids = {}
+        self._shapes = {}
+        self.roots = []
+        self.positions = []
+        for plan in plans:
+            positions: dict[int, list[int]] = {}
+            self.roots.append(self._make_shape(plan.root, (), positions))
+            self.positions.append(positions)
+
+    def _make_shape(self, node: PathNode, path: tuple, positions: dict[int, list[int]]) -> ShapeNode:
+        """
+        Creates the shape of a node of a plan's trie. Equal shapes are only created once.
+        :param node: the node in the trie of the plan
+        :param path: the path of the node
+        :param positions: collects the column positions of the plan for every path id
+        :return: the shape of the node
+        """
+        path_id = None
+        if node.columns:
+            path_id = self._path_ids.setdefault(path, len(self._path_ids))
+            positions[path_id] = node.columns
+        children = {key: self._make_shape(child, path + (key,), positions) for key, child in node.children.items()}
+        signature = (path, path_id, tuple((key, id(child)) for key, child in sorted(children.items())))
+        if signature not in self._shapes:
+            shape = ShapeNode(path_id)
+            shape.children = children
+            self._shapes[signature] = shape
+        return self._shapes[signature]
+
+    @staticmethod
+    def walk(shapes: set[ShapeNode], value: object,
+             fan_out_limit: int = None) -> dict[ShapeNode, list[dict[int, object]]]:
+        """
+        Walks a value of the document for all shapes at once
+        :param shapes: the shapes that are read at the position of the value
+        :param value: the value within the document
+        :param fan_out_limit: optional, the maximum number of partial rows per shape
+        :return: the partial rows for every shape as dicts of path id and value
+        """
+        if isinstance(value, list):
+            results = {shape: [] for shape in shapes}
+            for item in value:
+                for shape, rows in SharedExtractionPlan.walk(shapes, item, fan_out_limit).items():
+                    results[shape].extend(rows)
+                    check_fan_out(len(results[shape]), fan_out_limit)
+            return results
+        if not isinstance(value, dict):
+            return {shape: [{shape.path_id: value}] if shape.path_id is not None else [{}] for shape in shapes}
+        needed: dict[str, set[ShapeNode]] = {}
+        for shape in shapes:
+            for key, child in shape.children.items():
+                if key in value:
+                    needed.setdefault(key, set()).add(child)
+        found = {key: SharedExtractionPlan.walk(children, value[key], fan_out_limit)
+                 for key, children in needed.items()}
+        results = {}
+        for shape in shapes:
+            rows = [{}]
+            for key, child in shape.children.items():
+                if key in found and found[key][child]:
+                    check_fan_out(len(rows) * len(found[key][child]), fan_out_limit)
+                    rows = [{**row, **other} for row in rows for other in found[key][child]]
+            results[shape] = rows
+        return results
+
+    def extract(self, doc: dict) -> list[list[tuple]]:
+        """
+        Extracts the rows of all tables from a document with a single walk
+        :param doc: the source document
+        :return: the rows of every plan, in the order of the plans
+        """
+        results = SharedExtractionPlan.walk(set(self.roots), doc, self.fan_out_limit)
+        return [plan.finish_rows(results[root], positions)
+                for plan, root, positions in zip(self.plans, self.roots, self.positions)]
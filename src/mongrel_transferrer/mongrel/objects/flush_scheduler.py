@@ -0,0 +1,96 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the flush scheduler that decides which target tables are written together.
+"""
+from __future__ import annotations
+
+from collections.abc import Iterable
+
+from .table import TableInfo
+from ..helpers.types.row_buffer import RowBuffer
+from ..helpers.exceptions import MalformedMappingException
+
+
+class FlushScheduler:
+    """
+    Decides which buffers are written in a flush. The topological order of the tables is computed once from the
+    dependencies. A table is only written when its own buffer exceeds the threshold or when a child that is written
+    needs its keys, ancestors needed by several children of the same flush are written once.
+    """
+    order: list[TableInfo]
+    ancestors: dict[TableInfo, list[TableInfo]]
+    threshold: int
+    _rank: dict[TableInfo, int]
+
+    def __init__(self, tables: list[TableInfo], dependencies: dict[str, list[TableInfo]], threshold: int):
+        """
+        Computes the topological order and the ancestors of every table
+        :param tables: the buffer lookups of all tables
+        :param dependencies: the tables that need to be written before a table, as created by create_dependencies
+        :param threshold: the number of buffered rows a table is written after
+        """
+        self.order = []
+        self.threshold = threshold
+        for table in tables:
+            self._visit(table, dependencies, [])
+        self._rank = {table: rank for rank, table in enumerate(self.order)}
+        self.ancestors = {}
+        for table in self.order:
+            found = set()
+            for parent in dependencies.get(table, []):
+                found.add(parent)
+                found.update(self.ancestors[parent])
+            self.ancestors[table] = sorted(found, key=self._rank.__getitem__)
+
+    def _visit(self, table: TableInfo, dependencies: dict[str, list[TableInfo]], path: list[TableInfo]) -> None:
+        """
+        Appends the table to the order after all tables it depends on
+        :param table: the table to place
+        :param dependencies: the tables that need to be written before a table
+        :param path: the tables that are currently placed and wait for this table
+        """
+        if table in self.order:
+            return
+        if table in path:
+            raise MalformedMappingException(f"The foreign keys of {table} form a cycle, it can't be written first.")
+        for parent in dependencies.get(table, []):
+            self._visit(parent, dependencies, path + [table])
+        self.order.append(table)
+
+    def due(self, data: dict[TableInfo, RowBuffer], tables: Iterable[TableInfo] = None) -> list[TableInfo]:
+        """
+        Finds the tables whose buffer exceeds the threshold
+        :param data: the buffers of all tables
+        :param tables: optional, the tables that are checked, e.g. the ones that received rows. Defaults to all tables
+        :return: the tables that need to be written
+        """
+        candidates = self.order if tables is None else set(tables)
+        return [table for table in candidates if len(data[table]) > self.threshold]
+
+    def schedule(self, tables: Iterable[TableInfo]) -> list[TableInfo]:
+        """
+        Adds the ancestors to the tables that are written. Every table is contained once, even if it is the ancestor
+        of several of the tables.
+        :param tables: the tables that need to be written
+        :return: the tables and their ancestors in the order they need to be written
+        """
+        scheduled = set()
+        for table in tables:
+            scheduled.add(table)
+            scheduled.update(self.ancestors[table])
+        return sorted(scheduled, key=self._rank.__getitem__)
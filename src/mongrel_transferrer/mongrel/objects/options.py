@@ -0,0 +1,191 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the options of a transfer, grouped by how the documents are read, how the rows are written and how the
+progress is stored.
+"""
+import copy
+import warnings
+
+from .enums import WriteMethod
+from .sink import Sink
+
+# the rows one document may produce for a table by default, a few hundred MB of partial rows
+DEFAULT_FAN_OUT_LIMIT = 1000000
+
+
+class ReadOptions:
+    """
+    How the documents are read from the source collection and turned into rows
+    """
+    workers: int
+    pipelined: bool
+    queue_size: int
+    shared_traversal: bool
+    cursor_batch_size: int
+    no_cursor_timeout: bool
+    compressors: str
+    read_preference: str
+    fan_out_limit: int
+
+    def __init__(self, workers: int = 1, pipelined: bool = False, queue_size: int = 8, shared_traversal: bool = True,
+                 cursor_batch_size: int = None, no_cursor_timeout: bool = False, compressors: str = None,
+                 read_preference: str = None, fan_out_limit: int = DEFAULT_FAN_OUT_LIMIT):
+        """
+        :param workers: the number of processes transferring the data in parallel, each one reading its own _id range
+        of the collection
+        :param pipelined: if True reading from mongo, extracting the rows and writing them overlap in separate threads
+        :param queue_size: the number of document chunks and batches that may wait between the threads of the
+        pipelined mode
+        :param shared_traversal: if True every document is walked once for all relations, otherwise it is walked
+        once per relation
+        :param cursor_batch_size: optional, the number of documents mongo sends per batch of the cursor
+        :param no_cursor_timeout: if True the server keeps the cursor open while it is idle, for slow targets
+        :param compressors: optional, the network compressors offered to mongo, e.g. "zstd,snappy". Zstd needs the
+        zstandard package, snappy the python-snappy package
+        :param read_preference: optional, the read preference of the source, e.g. "secondaryPreferred" to keep the
+        load off the primary
+        :param fan_out_limit: the maximum number of rows a single document may produce for one table. Sibling lists
+        are combined with a cartesian product, a document exceeding the limit stops the transfer with a
+        FanOutLimitException before its rows fill the memory. None disables the limit
+        """
+        self.workers = max(workers, 1)
+        self.pipelined = pipelined
+        self.queue_size = queue_size
+        self.shared_traversal = shared_traversal
+        self.cursor_batch_size = cursor_batch_size
+        self.no_cursor_timeout = no_cursor_timeout
+        self.compressors = compressors
+        self.read_preference = read_preference
+        self.fan_out_limit = fan_out_limit
+
+
+class WriteOptions:
+    """
+    How the rows are buffered and where they are written to
+    """
+    batch_size: int
+    write_method: WriteMethod
+    seen_key_capacity: int
+    skip_existing: bool
+    memory_budget: int
+    spill_directory: str
+    sink: Sink
+
+    def __init__(self, batch_size: int = 1000, write_method: WriteMethod = WriteMethod.INSERT,
+                 seen_key_capacity: int = 100000, skip_existing: bool = False, memory_budget: int = None,
+                 spill_directory: str = None, sink: Sink = None):
+        """
+        :param batch_size: the number of rows a table buffers before they are written
+        :param write_method: WriteMethod.INSERT writes the batches with multi-row inserts, WriteMethod.COPY streams them
+        through a staging table with COPY. Conflicts are ignored either way
+        :param seen_key_capacity: the number of primary keys remembered per table. Rows whose key was already extracted
+        in this run are dropped before they are buffered, 0 disables it. Not used when rows are upserted
+        :param skip_existing: if True the primary keys of the target tables are loaded before the transfer and rows
+        that already exist are not sent again. Speeds up re-runs into a filled database, not used when rows are
+        upserted
+        :param memory_budget: optional, the approximate number of bytes the row buffers of every worker may hold. The
+        batch size counts rows no matter how wide they are, the budget keeps the memory flat. The largest buffers are
+        flushed when it is exceeded, buffers that would force early writes of their parent tables are spilled to
+        compressed temporary files instead
+        :param spill_directory: optional, the directory of the spill files, defaults to the temporary directory
+        :param sink: optional, where the rows are written to. Defaults to the postgres database of the sql parameters,
+        a FileSink writes csv or parquet files and the creation script instead
+        """
+        self.batch_size = batch_size
+        self.write_method = write_method
+        self.seen_key_capacity = seen_key_capacity
+        self.skip_existing = skip_existing
+        self.memory_budget = memory_budget
+        self.spill_directory = spill_directory
+        self.sink = sink
+
+
+class CheckpointOptions:
+    """
+    How the progress of a transfer is stored and how later runs continue from it
+    """
+    enabled: bool
+    resume: bool
+    name: str
+    incremental_field: str
+    follow_changes: bool
+    max_batch_rows: int
+    max_latency_ms: int
+
+    def __init__(self, enabled: bool = False, resume: bool = False, name: str = None, incremental_field: str = None,
+                 follow_changes: bool = False, max_batch_rows: int = None, max_latency_ms: int = 1000):
+        """
+        :param enabled: if True the progress is stored in the table mongrel_checkpoints of the target database after
+        every flush. The documents are read in _id order then
+        :param resume: if True the transfer continues after the last checkpoint instead of starting over, implies
+        enabled
+        :param name: optional, the name of the checkpoint, defaults to mongo_database.mongo_collection
+        :param incremental_field: optional, the watermark field for incremental transfers, e.g. updated_at or _id. Only
+        the documents changed since the previous run are read and their rows are upserted, including the n:m helper
+        rows. Runs in a single process and implies enabled. The documents are sorted by the field, it needs an
+        ascending index, otherwise every run sorts the whole query result on the server
+        :param follow_changes: if True the change stream of the collection is tailed instead of transferring it once.
+        Runs until the stream is closed and continues after the stored resume token when it is restarted. Needs a
+        replica set, deletes need pre-images for documents whose root rows are not keyed by _id
+        :param max_batch_rows: optional, the number of changed rows that triggers a write when following changes,
+        defaults to the batch size
+        :param max_latency_ms: the maximum time in milliseconds a change waits before it is written
+        """
+        self.enabled = enabled or resume or incremental_field is not None
+        self.resume = resume
+        self.name = name
+        self.incremental_field = incremental_field
+        self.follow_changes = follow_changes
+        self.max_batch_rows = max_batch_rows
+        self.max_latency_ms = max_latency_ms
+
+
+class TransferOptions:
+    """
+    All options of a transfer, the groups not given keep their defaults
+    """
+    read: ReadOptions
+    write: WriteOptions
+    checkpoint: CheckpointOptions
+
+    def __init__(self, read: ReadOptions = None, write: WriteOptions = None, checkpoint: CheckpointOptions = None):
+        """
+        :param read: optional, how the documents are read
+        :param write: optional, how the rows are buffered and written
+        :param checkpoint: optional, how the progress is stored
+        """
+        self.read = read if read is not None else ReadOptions()
+        self.write = write if write is not None else WriteOptions()
+        self.checkpoint = checkpoint if checkpoint is not None else CheckpointOptions()
+
+
+def resolve_options(options: TransferOptions = None, batch_size: int = None) -> TransferOptions:
+    """
+    Fills in the default options and applies the deprecated batch_size argument of the transfer signatures
+    :param options: optional, the options of the transfer
+    :param batch_size: deprecated, overrides the batch size of the write options
+    :return: the options of the transfer, a copy if the batch size was overridden
+    """
+    options = options if options is not None else TransferOptions()
+    if batch_size is not None:
+        warnings.warn("batch_size is deprecated, pass it in the write options of the transfer options instead",
+                      DeprecationWarning, stacklevel=3)
+        options = copy.copy(options)
+        options.write = copy.copy(options.write)
+        options.write.batch_size = batch_size
+    return options
@@ -0,0 +1,154 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the stages of the pipelined transfer. The stages run in their own threads and are connected by bounded
+queues, a full queue blocks the stage before it.
+"""
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+
+QUEUE_TIMEOUT = 0.5
+_DONE = object()
+
+
+class _Failure:
+    """
+    Wraps an exception raised in a stage so it can be passed through a queue
+    """
+    error: BaseException
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def prefetch(iterable: Iterable, queue_size: int = 8, chunk_size: int = 256) -> Iterator:
+    """
+    Reads the iterable in a background thread, e.g. to fetch documents from mongo while the previous ones are
+    processed. The items are passed in chunks to keep the locking overhead low.
+    :param iterable: the iterable that is read in the background
+    :param queue_size: the number of chunks that may be read ahead
+    :param chunk_size: the number of items per chunk
+    :return: yields the items of the iterable in their order
+    :raises: any exception raised while reading the iterable
+    """
+    items = iter(iterable)
+    chunks = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=QUEUE_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        chunk = []
+        while True:
+            try:
+                item = next(items, _DONE)
+            except BaseException as error:
+                put(_Failure(error))
+                return
+            if item is _DONE:
+                break
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                if not put(chunk):
+                    return
+                chunk = []
+        if chunk:
+            put(chunk)
+        put(_DONE)
+
+    reader = threading.Thread(target=read, name="mongrel-reader", daemon=True)
+    reader.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, _Failure):
+                raise chunk.error
+            yield from chunk
+    finally:
+        stop.set()
+        reader.join()
+
+
+class BackgroundWriter:
+    """
+    Runs the write jobs in a background thread in the order they were submitted. The queue of jobs is bounded, so
+    submitting blocks while the writer is behind.
+    """
+    write_function: Callable
+    jobs: queue.Queue
+    error: BaseException
+
+    def __init__(self, write_function: Callable, queue_size: int = 4):
+        """
+        Starts the writer thread
+        :param write_function: the function that is called with every submitted job
+        :param queue_size: the number of jobs that may wait for the writer
+        """
+        self.write_function = write_function
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="mongrel-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is _DONE:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.write_function(job)
+            except BaseException as error:
+                self.error = error
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, job: object) -> None:
+        """
+        Hands a job to the writer, blocks while the queue is full
+        :param job: the job for the write function
+        :raises: the exception of a previously failed job
+        """
+        while True:
+            self._raise_error()
+            try:
+                self.jobs.put(job, timeout=QUEUE_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def close(self) -> None:
+        """
+        Waits until all submitted jobs are written and stops the writer thread
+        :raises: the exception of a failed job
+        """
+        self.jobs.put(_DONE)
+        self._thread.join()
+        self._raise_error()
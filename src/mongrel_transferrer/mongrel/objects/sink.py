@@ -0,0 +1,371 @@
+"""
+    MONGREL: MONgodb Going RELational
+    Copyright (C) 2023 Ricardo Prida
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Contains the sinks the transferred rows are written to, the target database or files for an offline bulk load.
+"""
+import csv
+import os
+import re
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+import pandas as pd
+from sqlalchemy import create_engine, text, URL
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .table import TableInfo
+from ..helpers.database_functions import NULL_MARKER, qualified_name, quote_identifier, staging_name, to_csv_value
+
+FILE_FORMATS = ("csv", "parquet")
+CREATION_SCRIPT_NAME = "creation_script.sql"
+LOAD_SCRIPT_NAME = "load_script.sql"
+
+
+class Sink(ABC):
+    """
+    The target of a transfer. A sink creates the tables, opens one connection per transferred partition and writes
+    the batches through it. Only sinks that are databases can store checkpoints, skip existing rows and upsert.
+    """
+    is_database: bool = False
+
+    @abstractmethod
+    def prepare(self, creation_script: str) -> None:
+        """
+        Creates the target tables
+        :param creation_script: the creation script of all tables
+        """
+
+    @abstractmethod
+    def connect(self, partition: str):
+        """
+        Opens the connection a partition is written through, used as a context manager
+        :param partition: the name of the partition, e.g. the name of its checkpoint
+        """
+
+    @abstractmethod
+    def write(self, relation_info: TableInfo, frame: pd.DataFrame, connection: object,
+              method: Callable = None) -> None:
+        """
+        Writes a batch of rows
+        :param relation_info: the table of the rows
+        :param frame: the rows
+        :param connection: the connection opened by connect
+        :param method: optional, the pandas insertion method of database sinks
+        """
+
+    def finish(self, tables: list[TableInfo]) -> None:
+        """
+        Called once every partition is written
+        :param tables: the written tables, every table after the tables it references
+        """
+
+
+class PostgresSink(Sink):
+    """
+    Writes the rows into the target postgres database
+    """
+    is_database = True
+    url: URL
+
+    def __init__(self, url: URL):
+        """
+        :param url: the url of the target database
+        """
+        self.url = url
+
+    def create_engine(self):
+        """
+        Creates the sqlalchemy engine of the target database
+        :return: the engine
+        """
+        return create_engine(self.url)
+
+    def prepare(self, creation_script: str) -> None:
+        """
+        Runs the creation statement on the target database
+        :param creation_script: the creation script to be executed
+        """
+        engine_go_brr = self.create_engine()
+        with engine_go_brr.connect() as connie:
+            splitted = creation_script.split(";")
+            for statement in splitted:
+                statement = statement.strip()
+                if len(statement) > 1:
+                    connie.execute(text(statement))
+                    connie.commit()
+        engine_go_brr.dispose()
+
+    @contextmanager
+    def connect(self, partition: str = None) -> Iterator[object]:
+        """
+        Opens a connection to the target database, the engine is disposed afterwards
+        :param partition: not needed, all partitions write into the same tables
+        :return: yields the connection
+        """
+        engine_go_brr = self.create_engine()
+        try:
+            with engine_go_brr.connect() as connie:
+                yield connie
+        finally:
+            engine_go_brr.dispose()
+
+    def write(self, relation_info: TableInfo, frame: pd.DataFrame, connection: object,
+              method: Callable = None) -> None:
+        """
+        Writes the rows with the insertion method, conflicts are handled by the method
+        :param relation_info: the table of the rows
+        :param frame: the rows
+        :param connection: the connection to the target database
+        :param method: the pandas insertion method
+        """
+        frame.to_sql(name=relation_info.table, schema=relation_info.schema, if_exists="append", method=method,
+                     con=connection, index=False)
+
+
+class _CsvChunk:
+    """
+    A csv file that rows are appended to. Every chunk starts with the header, null values are written as an unquoted
+    \\N, so COPY ... WITH (FORMAT csv, HEADER, NULL '\\N') tells them apart from empty strings.
+    """
+    path: str
+    rows: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._file = open(path, "w", encoding="utf-8", newline="")  # pylint: disable=consider-using-with
+
+    def write(self, frame: pd.DataFrame) -> None:
+        """
+        Appends the rows to the file
+        :param frame: the rows
+        """
+        if self.rows == 0:
+            self._file.write(",".join(to_csv_value(name) for name in frame.columns))
+            self._file.write("\n")
+        for row in frame.itertuples(index=False, name=None):
+            self._file.write(",".join(to_csv_value(value) for value in row))
+            self._file.write("\n")
+        self.rows += len(frame)
+
+    def close(self) -> None:
+        """
+        Closes the file
+        """
+        self._file.close()
+
+
+class _ParquetChunk:
+    """
+    A parquet file that every batch is appended to as a row group. The schema is taken from the first batch, columns
+    without any value there are stored as strings. Needs the pyarrow package.
+    """
+    path: str
+    rows: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._writer = None
+
+    def write(self, frame: pd.DataFrame) -> None:
+        """
+        Appends the rows to the file as a row group
+        :param frame: the rows
+        """
+        table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+        if self._writer is None:
+            schema = pyarrow.schema([field.with_type(pyarrow.string()) if pyarrow.types.is_null(field.type) else field
+                                     for field in table.schema])
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+        self.rows += len(frame)
+
+    def close(self) -> None:
+        """
+        Writes the footer and closes the file
+        """
+        if self._writer is not None:
+            self._writer.close()
+
+
+class FilePartition:
+    """
+    The connection of a file sink. Every table of the partition is written to rolling chunks, a chunk is closed
+    once it holds the configured number of rows and the next rows go to a new one.
+    """
+    directory: str
+    file_format: str
+    chunk_rows: int
+    name: str
+    _chunks: dict[TableInfo, object]
+    _counts: dict[TableInfo, int]
+
+    def __init__(self, directory: str, file_format: str, chunk_rows: int, name: str):
+        """
+        :param directory: the directory of the sink
+        :param file_format: csv or parquet
+        :param chunk_rows: the maximum number of rows of a chunk
+        :param name: the name of the partition, the chunks are named after it
+        """
+        self.directory = directory
+        self.file_format = file_format
+        self.chunk_rows = max(chunk_rows, 1)
+        self.name = re.sub(r"[^\w.-]", "_", name) if name else "part"
+        self._chunks = {}
+        self._counts = {}
+
+    def open_chunk(self, relation_info: TableInfo) -> object:
+        """
+        Opens the next chunk of a table, the tables get a directory each
+        :param relation_info: the table of the chunk
+        :return: the chunk
+        """
+        table_directory = os.path.join(self.directory, str(relation_info))
+        os.makedirs(table_directory, exist_ok=True)
+        count = self._counts.get(relation_info, 0)
+        self._counts[relation_info] = count + 1
+        path = os.path.join(table_directory, f"{self.name}-{count:05d}.{self.file_format}")
+        return _ParquetChunk(path) if self.file_format == "parquet" else _CsvChunk(path)
+
+    def write(self, relation_info: TableInfo, frame: pd.DataFrame) -> None:
+        """
+        Appends the rows to the open chunk of the table, rolling over to new chunks when it is full
+        :param relation_info: the table of the rows
+        :param frame: the rows
+        """
+        offset = 0
+        while offset < len(frame):
+            if relation_info not in self._chunks:
+                self._chunks[relation_info] = self.open_chunk(relation_info)
+            chunk = self._chunks[relation_info]
+            taken = min(self.chunk_rows - chunk.rows, len(frame) - offset)
+            chunk.write(frame.iloc[offset:offset + taken])
+            offset += taken
+            if chunk.rows >= self.chunk_rows:
+                chunk.close()
+                del self._chunks[relation_info]
+
+    def commit(self) -> None:
+        """
+        Files have no transactions, the rows are written as they come
+        """
+
+    def close(self) -> None:
+        """
+        Closes the open chunks of all tables
+        """
+        for chunk in self._chunks.values():
+            chunk.close()
+        self._chunks.clear()
+
+
+class FileSink(Sink):
+    """
+    Writes the rows of every table to csv or parquet files instead of the database, e.g. for a bulk load with
+    COPY FROM or into another warehouse later. Relations sharing an alias are written to the files of the alias.
+    Every partition writes its own rolling chunks into the directory of a table, so parallel workers never share a
+    file. The same row may be written by several partitions, e.g. a parent referenced by documents of different
+    partitions. The creation script is written next to the table directories, csv files also get a load script.
+    """
+    directory: str
+    file_format: str
+    chunk_rows: int
+
+    def __init__(self, directory: str, file_format: str = "csv", chunk_rows: int = 1000000):
+        """
+        :param directory: the directory the files are written to
+        :param file_format: csv or parquet, parquet needs the pyarrow package from the parquet extra
+        :param chunk_rows: the maximum number of rows per file
+        """
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"The file format {file_format} is not supported, use one of {FILE_FORMATS}")
+        if file_format == "parquet" and pyarrow is None:
+            raise ImportError("Parquet files need the pyarrow package, install mongrel_transferrer[parquet]")
+        self.directory = directory
+        self.file_format = file_format
+        self.chunk_rows = chunk_rows
+
+    def prepare(self, creation_script: str) -> None:
+        """
+        Writes the creation script into the directory
+        :param creation_script: the creation script of all tables
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, CREATION_SCRIPT_NAME), "w", encoding="utf-8") as file:
+            file.write(creation_script)
+
+    @contextmanager
+    def connect(self, partition: str = None) -> Iterator[FilePartition]:
+        """
+        Opens the chunks of a partition, they are closed afterwards
+        :param partition: the name of the partition, the chunks are named after it
+        :return: yields the partition
+        """
+        files = FilePartition(self.directory, self.file_format, self.chunk_rows, partition)
+        try:
+            yield files
+        finally:
+            files.close()
+
+    def write(self, relation_info: TableInfo, frame: pd.DataFrame, connection: FilePartition,
+              method: Callable = None) -> None:
+        """
+        Appends the rows to the chunks of the table
+        :param relation_info: the table of the rows
+        :param frame: the rows
+        :param connection: the partition opened by connect
+        :param method: not needed for files
+        """
+        connection.write(relation_info, frame)
+
+    def finish(self, tables: list[TableInfo]) -> None:
+        """
+        Writes the load script of the csv files. The psql script loads the tables in the given order, the files of a
+        table are copied into a temporary staging table which is merged into the table with ON CONFLICT DO NOTHING.
+        So rows written by several partitions are loaded once, like the database sink ignores conflicting rows.
+        Parquet files get no load script.
+        :param tables: the written tables, every table after the tables it references
+        """
+        if self.file_format != "csv":
+            return
+        with open(os.path.join(self.directory, LOAD_SCRIPT_NAME), "w", encoding="utf-8") as script:
+            script.write(f"-- Run with psql from this directory after {CREATION_SCRIPT_NAME}\n")
+            for relation_info in tables:
+                table_directory = os.path.join(self.directory, str(relation_info))
+                if not os.path.isdir(table_directory):
+                    continue
+                files = sorted(name for name in os.listdir(table_directory) if name.endswith(".csv"))
+                if not files:
+                    continue
+                target = qualified_name(relation_info.table, relation_info.schema)
+                staging = staging_name(relation_info.table, relation_info.schema)
+                script.write(f"BEGIN;\nCREATE TEMPORARY TABLE {staging} (LIKE {target} INCLUDING DEFAULTS) "
+                             "ON COMMIT DROP;\n")
+                for name in files:
+                    with open(os.path.join(table_directory, name), encoding="utf-8", newline="") as file:
+                        columns = ", ".join(quote_identifier(column) for column in next(csv.reader(file)))
+                    path = f"{relation_info}/{name}".replace("'", "''")
+                    script.write(f"\\copy {staging} ({columns}) FROM '{path}' "
+                                 f"WITH (FORMAT csv, HEADER, NULL '{NULL_MARKER}')\n")
+                script.write(f"INSERT INTO {target} SELECT * FROM {staging} ON CONFLICT DO NOTHING;\nCOMMIT;\n")
@@ -17,12 +17,13 @@
 
 This file contains the main logic for the objects in the transfers.
 """
+import copy
 from enum import Enum
 from typing import Any
 import pandas as pd
 from ..helpers.constants import PATH_SEP, CONVERSION_FIELDS, ALIAS, CONV_ARGS, REFERENCE_KEY, TRAN_OPTIONS, \
-    TARGET_TYPE, SOURCE_TYPE
-from ..helpers.conversions import Conversions
+    TARGET_TYPE, SOURCE_TYPE, CACHE_SIZE
+from ..helpers.conversions import Conversions, CachedConversion
 from ..helpers.exceptions import MalformedMappingException
 from ..helpers.utils import decide_sql_definition
 
@@ -100,10 +101,12 @@ class Column:
     foreign_reference: TableInfo
     conversion_args: dict
     conversion_function: Any
+    cache_size: int
+    converter: CachedConversion
 
     def __init__(self, target_name: str, path: list[str], sql_definition: str, field_type: Field,
                  foreign_reference: TableInfo = None, conversion_function=None,
-                 conversion_args=None):
+                 conversion_args=None, cache_size: int = 0):
         """
         Initalization of the column
             example in 
@@ -115,6 +118,7 @@ class Column:
         :param conversion_function: the conversion function that's going to be applied to every value read for that
         field
         :param conversion_args: Arguments the conversion function is being called with
+        :param cache_size: the number of distinct values whose converted results are remembered, 0 disables it
         """
         self.target_name = target_name
         self.path = path
@@ -122,7 +126,10 @@ class Column:
         self.field_type = field_type
         self.foreign_reference = foreign_reference
         self.conversion_function = conversion_function if conversion_function else Conversions.do_nothing
-        self.conversion_args = conversion_args if conversion_args else {}
+        # the args are copied, conversions like string_to_date reorder their formats per column
+        self.conversion_args = copy.deepcopy(conversion_args) if conversion_args else {}
+        self.cache_size = cache_size
+        self.converter = CachedConversion(self.conversion_function, self.conversion_args, cache_size)
         self.translated_path = ''
         if path is not None:
             for sub_path in path:
@@ -164,6 +171,9 @@ class Table:
     prepped: bool
     alias: TableInfo
     pks: list[str]
+    nm_helper: bool
+    nm_parent: TableInfo
+    nm_parent_keys: dict[str, str]
 
     def __init__(self, info, options: dict = None):
         """
@@ -179,6 +189,9 @@ class Table:
             options = {}
         self.alias = TableInfo(options[ALIAS]) if ALIAS in options else None
         self.pks = []
+        self.nm_helper = False
+        self.nm_parent = None
+        self.nm_parent_keys = {}
 
     def __eq__(self, other):
         """
@@ -196,16 +209,23 @@ class Table:
                 return True
         return False
 
-    def make_df(self) -> pd.DataFrame:
+    def get_column_names(self) -> list[str]:
         """
-        Creates a Dataframe object containing all the columns
-        :return: The created Dataframe
+        Fetches the names of all columns that are filled from the source documents
+        :return: the column names in the order of the columns
         """
         collie_strs = []
         for col in self.columns:
             if col.path is not None:
                 collie_strs.append(col.target_name)
-        df = pd.DataFrame(columns=collie_strs)
+        return collie_strs
+
+    def make_df(self) -> pd.DataFrame:
+        """
+        Creates a Dataframe object containing all the columns
+        :return: The created Dataframe
+        """
+        df = pd.DataFrame(columns=self.get_column_names())
         df.set_index(self.pks)
         return df
 
@@ -258,7 +278,7 @@ class Table:
                                    other_col.sql_definition,
                                    Field.PRIMARY_KEY if fk_are_pk else Field.FOREIGN_KEY, rel_info,
                                    conversion_function=other_col.conversion_function,
-                                   conversion_args=other_col.conversion_args))
+                                   conversion_args=other_col.conversion_args, cache_size=other_col.cache_size))
         for column in self.columns:
             if column.field_type == Field.PRIMARY_KEY and column.target_name not in self.pks:
                 self.pks.append(column.target_name)
@@ -423,8 +443,21 @@ class Table:
         return_relation = Table(TableInfo(schema=self.info.schema, table=f'{own_name}2{other_name}'))
         return_relation.relations["n:1"] = [self.info, other.info]
         return_relation.prepare_columns(other_relations, fk_are_pk=True)
+        return_relation.nm_helper = True
+        # the helper rows belong to this table, they are refreshed together with its rows
+        return_relation.nm_parent = self.alias if self.alias else self.info
+        return_relation.nm_parent_keys = return_relation.get_reference_keys(return_relation.nm_parent)
         return return_relation
 
+    def get_reference_keys(self, info: TableInfo) -> dict[str, str]:
+        """
+        Finds the columns referencing the primary key of another table
+        :param info: the info or alias of the referenced table
+        :return: a dictionary mapping the referencing columns to the referenced primary key columns
+        """
+        return {col.target_name: col.target_name[len(info.table) + 1:] for col in self.columns
+                if col.foreign_reference == info}
+
     def add_column(self, json_path: str, column_value: str, keys_dict: dict = None, convert_dict: dict = None) -> None:
         """
         Adds a column to the relation if it does not yet exist, as well as foreign relations and required information
@@ -465,7 +498,7 @@ class Table:
             target_type = convert_dict[TARGET_TYPE]
             conversion_function = Conversions.get_conversion(source_type, target_type)
             return conversion_function, convert_dict[
-                CONV_ARGS] if CONV_ARGS in convert_dict else None
+                CONV_ARGS] if CONV_ARGS in convert_dict else None, convert_dict.get(CACHE_SIZE, 0)
 
         name, definition = parse_column_value(column_value)
         if name not in self.columns:
@@ -474,9 +507,10 @@ class Table:
             else:
                 field_type, foreign_reference = Field.BASE, None
             if convert_dict is not None and name in convert_dict:
-                conversion_function, extra_args = parse_column_conversion(convert_dict[name])
+                conversion_function, extra_args, cache_size = parse_column_conversion(convert_dict[name])
             else:
-                conversion_function, extra_args = None, None
+                conversion_function, extra_args, cache_size = None, None, 0
             broken_path = json_path.strip().split('.')
             self.columns.append(
-                Column(name, broken_path, definition, field_type, foreign_reference, conversion_function, extra_args))
+                Column(name, broken_path, definition, field_type, foreign_reference, conversion_function, extra_args,
+                       cache_size))
@@ -45,6 +45,9 @@ class TableBuilder:
             if column.foreign_reference == info:
                 column.foreign_reference = None
         table.relations['n:1'].remove(referenced_table.info)
+        if table.nm_parent == info:
+            table.nm_parent = None
+            table.nm_parent_keys = {}
         return table
 
     def _prepare_nm_relations(self, relations_vals: list):
@@ -1,31 +1,64 @@
 """
 Transfer Logic can be found here
 """
-from sqlalchemy import create_engine, URL, text
+import functools
+import multiprocessing
+from collections.abc import Callable, Iterable
+from typing import Union
+
+from sqlalchemy import URL
 import pandas as pd
 import pymongo
 from tqdm import tqdm
 
-from ..helpers.map_flattener import flatten
-from ..helpers.constants import PATH_SEP
-from ..objects.table import Table, TableInfo, Field
+from ..helpers.conversions import Conversions
+from ..helpers.exceptions import FanOutLimitException
+from ..helpers.types.row_buffer import RowBuffer
+from ..helpers.types.spill_file import SpillFile
+from ..helpers.types.seen_keys import ExistingKeys
+from ..objects.table import Table, TableInfo
+from ..objects.extraction_plan import ExtractionPlan, SharedExtractionPlan
+from ..objects.flush_scheduler import FlushScheduler
+from ..objects.sink import Sink, PostgresSink
 from ..objects.relation_builder import RelationBuilder
 from ..objects.table_builder import TableBuilder
-from ..helpers.database_functions import insert_on_conflict_nothing
+from ..objects.enums import WriteMethod
+from ..objects.options import TransferOptions, resolve_options
+from ..objects.change_stream import ChangeStreamFollower
+from ..objects.pipeline import BackgroundWriter, prefetch
+from ..objects.checkpoint import Checkpoint, CheckpointStore, TransferProgress, PARTITION_SEP
+from ..helpers.database_functions import insert_on_conflict_nothing, copy_on_conflict_nothing, \
+    insert_on_conflict_update, copy_on_conflict_update, delete_by_keys, stream_keys
+from ..helpers.mongo_functions import compute_id_partitions, build_projection
+
+PARTITIONS_PER_WORKER = 4
+INCREMENTAL_SEP = "@"
+# the share of the memory budget the buffers are reduced to once it is exceeded
+MEMORY_RELIEF_RATIO = 0.75
+# a table and the rows that are written to it, spilled rows are only read when they are written
+Batch = tuple[TableInfo, Union[pd.DataFrame, SpillFile]]
+# the existing keys of the target tables by checkpoint name, loaded once by every process that transfers partitions
+EXISTING_KEY_CACHE: dict[str, dict[TableInfo, ExistingKeys]] = {}
 
 
 class Transferrer:
     """
     The main class that handles the transfer
     """
-    dependencies: dict[str, list[TableInfo]]
-    batch_size: int
     relations: list[Table]
-    length_lookup: dict[TableInfo, int]
+    options: TransferOptions
+    sink: Sink
+    upsert: bool
+    checkpoint_store: CheckpointStore
+    primary_keys: dict[TableInfo, list[str]]
+    batch_conversions: dict[TableInfo, dict[str, tuple[Callable, dict]]]
+    nm_helpers: dict[TableInfo, list[Table]]
+    scheduler: FlushScheduler
 
     def __init__(self, relation_list: list[Table], mongo_host: str, mongo_database: str, mongo_collection: str,
                  sql_host: str, sql_database: str, mongo_port: int = None, sql_port: int = None, sql_user=None,
-                 sql_password=None, mongo_user: str = None, mongo_password: str = None, batch_size=1000):
+                 sql_password=None, mongo_user: str = None, mongo_password: str = None, batch_size: int = None,
+                 options: TransferOptions = None):
         """
         Initializes the transfer class with all the required information
         :param relation_list: the list of all prepped relations
@@ -40,39 +73,97 @@ class Transferrer:
         :param sql_password: optional, the password of the user for the target database
         :param mongo_user: optional, the user of the source mongo database
         :param mongo_password: optional, the password of the user for the source database
-        :param batch_size: the batch size used
+        :param batch_size: deprecated, use the batch size of the write options instead
+        :param options: optional, how the documents are read, the rows are written and the progress is stored.
+        Checkpoints, incremental transfers and skipping existing rows need a database sink
         """
         self.mongo_collection = mongo_collection
-        self.sql_password = sql_password
-        self.sql_user = sql_user
-        self.sql_port = sql_port
         self.mongo_password = mongo_password
         self.mongo_port = mongo_port
-        self.sql_host = sql_host
-        self.sql_database = sql_database
         self.mongo_user = mongo_user
         self.mongo_database = mongo_database
         self.mongo_host = mongo_host
-        self.dependencies = Transferrer.create_dependencies(relation_list)
         self.relations = relation_list
-        self.batch_size = batch_size
-        self.length_lookup = {}
+        self.options = resolve_options(options, batch_size)
+        self.upsert = self.options.checkpoint.incremental_field is not None
+        self.checkpoint_store = CheckpointStore()
+        self.primary_keys = self._get_primary_keys()
+        self.batch_conversions = self._get_batch_conversions()
+        self.nm_helpers = {}
+        self.sink = self.options.write.sink if self.options.write.sink is not None else PostgresSink(
+            URL.create("postgresql", username=sql_user, password=sql_password, host=sql_host, port=sql_port,
+                       database=sql_database))
+        if not self.sink.is_database and (self.options.checkpoint.enabled or self.options.write.skip_existing):
+            raise ValueError("Checkpoints, incremental transfers and skipping existing rows need a database sink")
+        for relation in relation_list:
+            if relation.nm_parent is not None:
+                self.nm_helpers.setdefault(relation.nm_parent, []).append(relation)
+        self.scheduler = FlushScheduler(list(self.primary_keys), Transferrer.create_dependencies(relation_list),
+                                        self.options.write.batch_size)
+
+    @property
+    def checkpoint_name(self) -> str:
+        """
+        The name the checkpoints are stored with, defaults to database.collection
+        :return: the name of the checkpoint
+        """
+        if self.options.checkpoint.name:
+            return self.options.checkpoint.name
+        return f'{self.mongo_database}.{self.mongo_collection}'
+
+    def get_insert_method(self, relation_info: TableInfo = None):
+        """
+        Picks the pandas insertion method for the chosen write method. Incremental transfers and change streams
+        update existing rows. Rows of tables shared by several relations only update their non-null columns.
+        :param relation_info: optional, the table that is written, required for updating existing rows
+        :return: the function pandas uses to write the batches
+        """
+        use_copy = self.options.write.write_method == WriteMethod.COPY
+        if self.upsert and relation_info is not None:
+            method = copy_on_conflict_update if use_copy else insert_on_conflict_update
+            shared = sum(1 for relation in self.relations if relation.alias and relation.alias == relation_info) > 1
+            return functools.partial(method, pks=self.primary_keys.get(relation_info, []), skip_nulls=shared)
+        if use_copy:
+            return copy_on_conflict_nothing
+        return insert_on_conflict_nothing
+
+    def create_sql_engine(self):
+        """
+        Creates the sqlalchemy engine of the target database, only database sinks have one
+        :return: the engine
+        """
+        return self.sink.create_engine()
+
+    def create_mongo_client(self) -> pymongo.MongoClient:
+        """
+        Creates the client of the source mongo
+        :return: the client
+        """
+        client_options = {}
+        if self.options.read.compressors:
+            client_options["compressors"] = self.options.read.compressors
+        if self.options.read.read_preference:
+            client_options["readPreference"] = self.options.read.read_preference
+        return pymongo.MongoClient(host=self.mongo_host, port=self.mongo_port, username=self.mongo_user,
+                                   password=self.mongo_password, **client_options)
+
+    def get_projection(self) -> dict:
+        """
+        Derives the projection of the source documents from the paths of all columns, so only the mapped fields are
+        sent by mongo
+        :return: the projection or None if the documents are read completely
+        """
+        paths = [column.path for relation in self.relations for column in relation.columns if column.path is not None]
+        if self.options.checkpoint.incremental_field is not None:
+            paths.append(self.options.checkpoint.incremental_field.split("."))
+        return build_projection(paths)
 
     def prepare_database(self, creation_script: str) -> None:
         """
-        Runs the creation statement on the target database
+        Creates the target tables with the creation statement, file sinks store it next to the files
         :param creation_script: the creation script to be executed
         """
-        url_object = URL.create("postgresql", username=self.sql_user, password=self.sql_password, host=self.sql_host,
-                                port=self.sql_port, database=self.sql_database)
-        engine_go_brr = create_engine(url_object)
-        with engine_go_brr.connect() as connie:
-            splitted = creation_script.split(";")
-            for statement in splitted:
-                statement = statement.strip()
-                if len(statement) > 1:
-                    connie.execute(text(statement))
-                    connie.commit()
+        self.sink.prepare(creation_script)
 
     @staticmethod
     def create_dependencies(relation_list: list[Table]) -> dict[str, list[TableInfo]]:
@@ -95,122 +186,458 @@ class Transferrer:
                         dependencies[info] = [column.foreign_reference]
         return dependencies
 
-    def create_data_dict(self):
+    def _get_primary_keys(self) -> dict[TableInfo, list[str]]:
         """
-        Creates the dataframes for all the relations
-        :return: a dictionary containing dataframes with RelationInfo lookups
+        Collects the primary key columns of all target tables. Relations sharing an alias share their primary key.
+        :return: a dictionary containing the primary key columns with RelationInfo lookups
         """
-        data: dict[TableInfo, pd.DataFrame] = {}
+        pks: dict[TableInfo, list[str]] = {}
         for relation in self.relations:
             relation_info = relation.info if not relation.alias else relation.alias
-            data[relation_info] = relation.make_df()
-        return data
+            keys = pks.setdefault(relation_info, [])
+            for name in relation.pks:
+                if name not in keys:
+                    keys.append(name)
+        return pks
 
-    def filter_dict(self, doc: dict, relation: Table, layer: int = 0):
+    def _get_batch_conversions(self) -> dict[TableInfo, dict[str, tuple[Callable, dict]]]:
         """
-        Walks the dictionary and only looks at the relevant paths
-        :param doc: a source document
-        :param relation: the relation to be filled
-        :param layer: the current layer of the walk, used in recursion
-        :return: the filtered dict containing only relevant information for the relation
+        Finds the columns that are converted as a whole right before they are written. A column qualifies if its
+        conversion has a batch version, it is not part of the primary key, which is needed unconverted to drop
+        repeated rows, and all relations sharing its buffer convert it the same way.
+        :return: a dictionary containing the batch conversion and its args for every such column with RelationInfo
+        lookups
         """
-        if isinstance(doc, dict):
-            rel_dict = {}
+        candidates: dict[TableInfo, dict[str, tuple[Callable, dict]]] = {}
+        for relation in self.relations:
+            relation_info = relation.info if not relation.alias else relation.alias
+            columns = candidates.setdefault(relation_info, {})
             for col in relation.columns:
-                if col.path is not None:
-                    for key in doc.keys():
-                        if len(col.path) > layer and key == col.path[layer]:
-                            rel_dict[key] = self.filter_dict(doc[key], relation, layer + 1)
-            return rel_dict
-        if isinstance(doc, list):
-            vals = []
-            for entry in doc:
-                vals.append(self.filter_dict(entry, relation, layer))
-            return vals
-        return doc
-
-    def read_document_lines(self, doc: dict, relation: Table) -> dict:
-        """
-        Reads the document with all the relevant information for the relation
+                if col.path is None:
+                    continue
+                conversion = (col.conversion_function, col.conversion_args)
+                columns[col.target_name] = conversion if columns.get(col.target_name, conversion) == conversion \
+                    else (None, None)
+        conversions = {}
+        for relation_info, columns in candidates.items():
+            for name, (function, args) in columns.items():
+                batch_function = Conversions.get_batch_conversion(function) if function is not None else None
+                if batch_function is not None and name not in self.primary_keys.get(relation_info, []):
+                    conversions.setdefault(relation_info, {})[name] = (batch_function, args)
+        return conversions
+
+    def convert_frame(self, relation_info: TableInfo, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Applies the batch conversions to the columns of a dataframe
+        :param relation_info: the table of the dataframe
+        :param frame: the unconverted rows
+        :return: the dataframe with the converted columns
+        """
+        for name, (batch_function, args) in self.batch_conversions.get(relation_info, {}).items():
+            if name in frame.columns:
+                frame[name] = pd.Series(batch_function(frame[name].tolist(), **args), index=frame.index,
+                                        dtype=object)
+        return frame
+
+    def load_existing_keys(self, connection: object) -> dict[TableInfo, ExistingKeys]:
+        """
+        Reads the primary keys of all target tables
+        :param connection: the connection to the target database
+        :return: a dictionary containing the existing keys with RelationInfo lookups
+        """
+        existing = {}
+        for relation_info, pks in self.primary_keys.items():
+            if pks:
+                keys = ExistingKeys()
+                for key in stream_keys(connection, relation_info.table, relation_info.schema, pks):
+                    keys.add(key)
+                existing[relation_info] = keys
+        return existing
+
+    def get_existing_keys(self, connection: object) -> dict[TableInfo, ExistingKeys]:
+        """
+        Returns the primary keys of all target tables. They are loaded by the first partition a process transfers
+        and shared by the following ones. Rows written by the earlier partitions are not added, they are sent again
+        and their conflicts are ignored.
+        :param connection: the connection to the target database
+        :return: a dictionary containing the existing keys with RelationInfo lookups
+        """
+        if self.checkpoint_name not in EXISTING_KEY_CACHE:
+            EXISTING_KEY_CACHE[self.checkpoint_name] = self.load_existing_keys(connection)
+            connection.commit()
+        return EXISTING_KEY_CACHE[self.checkpoint_name]
+
+    def create_data_dict(self, existing_keys: dict[TableInfo, ExistingKeys] = None) -> dict[TableInfo, RowBuffer]:
+        """
+        Creates the row buffers for all the relations. Relations sharing an alias share one buffer containing the
+        columns of all of them. Upserted rows must not be dropped, so the seen keys are only tracked otherwise.
+        :param existing_keys: optional, the keys of the rows that already exist in the target tables
+        :return: a dictionary containing row buffers with RelationInfo lookups
+        """
+        if existing_keys is None or self.upsert:
+            existing_keys = {}
+        seen_capacity = 0 if self.upsert else self.options.write.seen_key_capacity
+        columns: dict[TableInfo, list[str]] = {}
+        for relation in self.relations:
+            relation_info = relation.info if not relation.alias else relation.alias
+            names = columns.setdefault(relation_info, [])
+            for name in relation.get_column_names():
+                if name not in names:
+                    names.append(name)
+        write = self.options.write
+        return {relation_info: RowBuffer(names, write.batch_size + 1, self.primary_keys[relation_info], seen_capacity,
+                                         existing_keys.get(relation_info), write.memory_budget is not None)
+                for relation_info, names in columns.items()}
+
+    def create_extraction_plans(self, data: dict[TableInfo, RowBuffer]) -> list[tuple[TableInfo, ExtractionPlan]]:
+        """
+        Compiles the extraction plans of all relations. The rows are extracted in the column order of the buffers.
+        :param data: the buffers of all relations
+        :return: a list containing the buffer lookup and the extraction plan of every relation
+        """
+        plans = []
+        for relation in self.relations:
+            relation_info = relation.info if not relation.alias else relation.alias
+            plans.append((relation_info, ExtractionPlan(relation, data[relation_info].columns,
+                                                        set(self.batch_conversions.get(relation_info, {})),
+                                                        self.options.read.fan_out_limit)))
+        return plans
+
+    def extract_rows(self, doc: dict, plans: list[tuple[TableInfo, ExtractionPlan]],
+                     shared_plan: SharedExtractionPlan = None) -> list[list[tuple]]:
+        """
+        Extracts the rows of all relations from a document
         :param doc: the source document
-        :param relation: the relation that uses the information
-        :return: the values as a dict for the columns
-        """
-        return_values = {}
-        rel_dict = self.filter_dict(doc, relation)
-        flattened = flatten(rel_dict, path_separator=PATH_SEP)
-        for row in flattened:
-            ok = True
-            for col in relation.columns:
-                if col.field_type == Field.PRIMARY_KEY:
-                    if col.translated_path not in row or row[col.translated_path] is None:
-                        ok = False
-                        break
-            if not ok:
-                continue
-            for col in relation.columns:
-                if col.path:
-                    if col.translated_path in row:
-                        return_values.setdefault(col.target_name, []).append(col.conversion_function(
-                            row[col.translated_path], **col.conversion_args))
-                    else:
-                        return_values.setdefault(col.target_name, []).append(None)
-        return return_values
+        :param plans: the extraction plans of all relations
+        :param shared_plan: optional, the combined plan that walks the document only once
+        :return: the rows of every relation, in the order of the plans
+        """
+        try:
+            if shared_plan is not None:
+                return shared_plan.extract(doc)
+            return [plan.extract(doc) for _, plan in plans]
+        except FanOutLimitException as err:
+            raise FanOutLimitException(f"Document {doc.get('_id')}: {err}") from err
+
+    def collect_batches(self, tables: list[TableInfo], data: dict[TableInfo, RowBuffer]) -> list[Batch]:
+        """
+        Takes the rows of the tables out of their buffers, empty buffers are skipped. Spilled rows are taken out as
+        their spill files and only read when they are written.
+        :param tables: the tables to write in the order they need to be written
+        :param data: all the current data stored yet
+        :return: the tables and their dataframes or spill files
+        """
+        batches = []
+        for relation_info in tables:
+            batches.extend((relation_info, spill_file) for spill_file in data[relation_info].take_spilled())
+            if data[relation_info].size > 0:
+                if self.options.read.workers > 1:
+                    data[relation_info].sort_by_keys()
+                batches.append((relation_info, data[relation_info].to_frame()))
+                data[relation_info].clear()
+        return batches
 
-    def write_cascading(self, relation_info: TableInfo, data: dict[TableInfo, pd.DataFrame],
-                        connection: object) -> None:
+    def _delete_helper_rows(self, relation_info: TableInfo, frame: pd.DataFrame, connection: object) -> None:
+        """
+        Deletes the n:m helper rows of the parents in the dataframe. The helper rows of the changed documents are
+        buffered as well and written again afterwards, so the helper tables contain the current relations only.
+        :param relation_info: the table of the dataframe
+        :param frame: the parent rows that are written
+        :param connection: the connection to the target database
         """
-        Writes the relation and all prerequisite relations to the target database
-        :param relation_info: the table to write
+        for helper in self.nm_helpers.get(relation_info, []):
+            helper_columns = list(helper.nm_parent_keys.keys())
+            parent_columns = [helper.nm_parent_keys[name] for name in helper_columns]
+            keys = set(frame[parent_columns].itertuples(index=False, name=None))
+            delete_by_keys(connection, helper.info.table, helper.info.schema, helper_columns, keys)
+
+    def write_batches(self, batches: list[Batch], connection: object) -> None:
+        """
+        Writes collected dataframes to the target database in their order. Incremental transfers and change streams
+        refresh the n:m helper rows of every parent and commit every table together with its helper rows.
+        :param batches: the tables and their dataframes or spill files
+        :param connection: the connection to the target database
+        """
+        for relation_info, frame in batches:
+            if isinstance(frame, SpillFile):
+                frame = frame.read()
+            frame = self.convert_frame(relation_info, frame)
+            if self.upsert:
+                self._delete_helper_rows(relation_info, frame, connection)
+            self.sink.write(relation_info, frame, connection, self.get_insert_method(relation_info))
+            if self.upsert:
+                connection.commit()
+
+    def _write_job(self, job: tuple[list[Batch], Checkpoint], connection: object) -> None:
+        """
+        Writes the batches of a flush and afterwards the checkpoint that is valid once they are written
+        :param job: the batches in the order they need to be written and the checkpoint or None
+        :param connection: the connection to the target database
+        """
+        batches, checkpoint = job
+        self.write_batches(batches, connection)
+        if checkpoint is not None:
+            self.checkpoint_store.save(connection, checkpoint)
+
+    def _submit_job(self, job: tuple[list[Batch], Checkpoint], connection: object,
+                   writer: BackgroundWriter = None) -> None:
+        """
+        Writes a job either directly or through the writer thread
+        :param job: the batches in the order they need to be written and the checkpoint or None
+        :param connection: the connection to the target database
+        :param writer: optional, the writer thread of the pipelined mode
+        """
+        if writer is None:
+            self._write_job(job, connection)
+        else:
+            writer.submit(job)
+
+    def flush(self, tables: list[TableInfo], data: dict[TableInfo, RowBuffer], connection: object,
+              writer: BackgroundWriter = None, progress: TransferProgress = None) -> None:
+        """
+        Writes the tables and their prerequisite tables in one job, either directly or through the writer thread. A
+        prerequisite of several of the tables is written once.
+        :param tables: the tables to write
         :param data: all the current data stored yet
         :param connection: the connection to the target database
+        :param writer: optional, the writer thread of the pipelined mode
+        :param progress: optional, the progress of a checkpointed transfer
         """
-        if relation_info in self.dependencies:
-            for info in self.dependencies[relation_info]:
-                self.write_cascading(info, data, connection)
-        if len(data[relation_info]) > 0:
-            data[relation_info].to_sql(name=relation_info.table, schema=relation_info.schema, if_exists="append",
-                                       method=insert_on_conflict_nothing, con=connection, index=False)
-            data[relation_info] = pd.DataFrame(columns=data[relation_info].columns)
+        batches = self.collect_batches(self.scheduler.schedule(tables), data)
+        if not batches:
+            return
+        checkpoint = None
+        if progress is not None:
+            for info, frame in batches:
+                progress.mark_flushed(info, len(frame))
+            checkpoint = progress.snapshot({info: len(buffer) for info, buffer in data.items()})
+        self._submit_job((batches, checkpoint), connection, writer)
 
-    def transfer_data(self):
+    def _relieve_memory(self, data: dict[TableInfo, RowBuffer], connection: object, writer: BackgroundWriter = None,
+                       progress: TransferProgress = None) -> None:
         """
-        The transfer process itself
+        Frees the largest buffers once the buffered rows exceed the memory budget, until they hold less than the
+        relief ratio of it. A buffer is flushed if its prerequisite tables hold no rows. Otherwise writing it would
+        force small writes of the prerequisites, its rows are spilled to the disk instead and written with its next
+        flush.
+        :param data: the buffers of all relations
+        :param connection: the connection to the target database
+        :param writer: optional, the writer thread of the pipelined mode
+        :param progress: optional, the progress of a checkpointed transfer
         """
-        mongo_client = pymongo.MongoClient(host=self.mongo_host, port=self.mongo_port, username=self.mongo_user,
-                                           password=self.mongo_password)
-        db = mongo_client[self.mongo_database]
-        collie = db[self.mongo_collection]
-        data: dict[TableInfo, pd.DataFrame] = self.create_data_dict()
-        url_object = URL.create("postgresql", username=self.sql_user, password=self.sql_password,
-                                host=self.sql_host, port=self.sql_port, database=self.sql_database)
-        engine_go_brr = create_engine(url_object)
-        with engine_go_brr.connect() as connie:
-            for doc in tqdm(collie.find()):
-                for relation in self.relations:
-                    vals = self.read_document_lines(doc, relation)
-                    if vals:
-                        df = pd.DataFrame.from_dict(vals, orient='index').transpose()
-                        relation_info = relation.info if not relation.alias else relation.alias
-                        df = df.dropna(axis=0, how='all')
-                        data[relation_info] = pd.concat([data[relation_info], df], ignore_index=True)
-                        data[relation_info].drop_duplicates(relation.pks)
-                for relation in self.relations:
-                    relation_info = relation.info if not relation.alias else relation.alias
-                    if len(data[relation_info].index) > self.batch_size:
-                        self.write_cascading(relation_info, data, connie)
-            for relation in self.relations:
-                relation_info = relation.info if not relation.alias else relation.alias
-                self.write_cascading(relation_info, data, connie)
+        used = sum(buffer.nbytes for buffer in data.values())
+        if used <= self.options.write.memory_budget:
+            return
+        flushed = []
+        for relation_info in sorted(data, key=lambda info: data[info].nbytes, reverse=True):
+            if used <= self.options.write.memory_budget * MEMORY_RELIEF_RATIO or data[relation_info].nbytes == 0:
+                break
+            used -= data[relation_info].nbytes
+            if any(len(data[parent]) > 0 and parent not in flushed
+                   for parent in self.scheduler.ancestors[relation_info]):
+                if self.options.read.workers > 1:
+                    data[relation_info].sort_by_keys()
+                data[relation_info].spill(self.options.write.spill_directory)
+            else:
+                flushed.append(relation_info)
+        if flushed:
+            self.flush(flushed, data, connection, writer, progress)
+
+    def process_documents(self, documents: Iterable[dict], data: dict[TableInfo, RowBuffer],
+                          plans: list[tuple[TableInfo, ExtractionPlan]], shared_plan: SharedExtractionPlan,
+                          connection: object, writer: BackgroundWriter = None,
+                          progress: TransferProgress = None) -> None:
+        """
+        Extracts the rows of all documents into the buffers. After every document the buffers that received rows are
+        checked, the ones exceeding the batch size are flushed together.
+        :param documents: the source documents
+        :param data: the buffers of all relations
+        :param plans: the extraction plans of all relations
+        :param shared_plan: optional, the combined plan that walks every document only once
+        :param connection: the connection to the target database
+        :param writer: optional, the writer thread of the pipelined mode
+        :param progress: optional, the progress of a checkpointed transfer
+        """
+        for doc in documents:
+            touched = []
+            for (relation_info, _), rows in zip(plans, self.extract_rows(doc, plans, shared_plan)):
+                if rows:
+                    was_empty = len(data[relation_info]) == 0
+                    if data[relation_info].extend(rows) and progress is not None and was_empty:
+                        progress.mark_buffered(relation_info)
+                    touched.append(relation_info)
+            if progress is not None:
+                progress.mark_document(doc)
+            due = self.scheduler.due(data, touched)
+            if due:
+                self.flush(due, data, connection, writer, progress)
+            if self.options.write.memory_budget is not None:
+                self._relieve_memory(data, connection, writer, progress)
+        self.flush(self.scheduler.order, data, connection, writer, progress)
+        if progress is not None:
+            self._submit_job(([], progress.snapshot({info: 0 for info in data}, finished=True)), connection, writer)
+
+    def transfer_partition(self, checkpoint: Checkpoint = None, position: int = 0) -> None:
+        """
+        Transfers all documents selected by the query of the checkpoint, starting after its watermark. Every call
+        uses its own connections, so partitions can be transferred in separate processes. The existing keys of the
+        target tables are loaded once per process if they are skipped.
+        In pipelined mode the documents are read by a reader thread and the batches are written by a writer thread
+        while the rows of the next documents are extracted.
+        :param checkpoint: optional, the partition to transfer and where to resume it
+        :param position: optional, the line of the progress bar
+        """
+        if checkpoint is None:
+            checkpoint = Checkpoint(self.checkpoint_name)
+        if checkpoint.finished:
+            return
+        mongo_client = self.create_mongo_client()
+        collie = mongo_client[self.mongo_database][self.mongo_collection]
+        progress = TransferProgress(checkpoint) if self.options.checkpoint.enabled else None
+        with self.sink.connect(checkpoint.name) as connie:
+            existing_keys = None
+            if self.options.write.skip_existing and not self.upsert:
+                existing_keys = self.get_existing_keys(connie)
+            data: dict[TableInfo, RowBuffer] = self.create_data_dict(existing_keys)
+            plans = self.create_extraction_plans(data)
+            shared_plan = SharedExtractionPlan([plan for _, plan in plans]) \
+                if self.options.read.shared_traversal else None
+            # the documents of a checkpointed transfer are sorted by the field, without an index on it the server
+            # sorts them in memory and fails past 100MB unless it may use the disk
+            documents = collie.find(checkpoint.resume_query(), self.get_projection(),
+                                    no_cursor_timeout=self.options.read.no_cursor_timeout,
+                                    allow_disk_use=True if progress is not None else None)
+            if self.options.read.cursor_batch_size:
+                documents = documents.batch_size(self.options.read.cursor_batch_size)
+            if progress is not None:
+                documents = documents.sort(checkpoint.field, pymongo.ASCENDING)
+            writer = None
+            if self.options.read.pipelined:
+                writer = BackgroundWriter(lambda job: self._write_job(job, connie), self.options.read.queue_size)
+                documents = prefetch(documents, self.options.read.queue_size)
+            try:
+                self.process_documents(tqdm(documents, position=position), data, plans, shared_plan, connie, writer,
+                                       progress)
+            finally:
+                if writer is not None:
+                    writer.close()
+                for buffer in data.values():
+                    buffer.drop_spilled()
         mongo_client.close()
 
+    def _transfer_partition_star(self, args: tuple) -> None:
+        """
+        Unpacks the arguments for transfer_partition, used by the process pool
+        :param args: the checkpoint and the progress bar position
+        """
+        self.transfer_partition(*args)
+
+    def _compute_partitions(self) -> list[Checkpoint]:
+        """
+        Splits the collection into _id ranges, one for every worker process
+        :return: the partitions as checkpoints that have not started yet
+        """
+        if self.options.read.workers == 1:
+            return [Checkpoint(self.checkpoint_name)]
+        mongo_client = self.create_mongo_client()
+        queries = compute_id_partitions(mongo_client[self.mongo_database][self.mongo_collection],
+                                        self.options.read.workers * PARTITIONS_PER_WORKER)
+        mongo_client.close()
+        return [Checkpoint(f'{self.checkpoint_name}{PARTITION_SEP}{idx:04d}', query)
+                for idx, query in enumerate(queries)]
+
+    def prepare_checkpoints(self) -> list[Checkpoint]:
+        """
+        Loads the checkpoints of a previous run when resuming. Otherwise the old checkpoints are removed and the
+        new partitions are stored before the transfer starts, so a crashed run can be resumed with the same
+        partitions.
+        :return: the partitions to transfer
+        """
+        if not self.options.checkpoint.enabled:
+            return self._compute_partitions()
+        engine_go_brr = self.create_sql_engine()
+        with engine_go_brr.connect() as connie:
+            self.checkpoint_store.prepare(connie)
+            if self.options.checkpoint.resume:
+                stored = self.checkpoint_store.load_partitions(connie, self.checkpoint_name)
+                if not stored:
+                    single = self.checkpoint_store.load(connie, self.checkpoint_name)
+                    stored = [single] if single else []
+                if stored:
+                    engine_go_brr.dispose()
+                    return stored
+            self.checkpoint_store.clear(connie, self.checkpoint_name)
+            checkpoints = self._compute_partitions()
+            for checkpoint in checkpoints:
+                self.checkpoint_store.save(connie, checkpoint)
+        engine_go_brr.dispose()
+        return checkpoints
+
+    def _prepare_incremental_checkpoint(self) -> Checkpoint:
+        """
+        Loads the watermark of the previous incremental transfer. The documents at the watermark are read again, the
+        upserts make that harmless and documents sharing the watermark value can't get lost.
+        :return: the checkpoint the incremental transfer starts from
+        """
+        name = f'{self.checkpoint_name}{INCREMENTAL_SEP}{self.options.checkpoint.incremental_field}'
+        engine_go_brr = self.create_sql_engine()
+        with engine_go_brr.connect() as connie:
+            self.checkpoint_store.prepare(connie)
+            checkpoint = self.checkpoint_store.load(connie, name)
+        engine_go_brr.dispose()
+        if checkpoint is None:
+            checkpoint = Checkpoint(name)
+        checkpoint.field = self.options.checkpoint.incremental_field
+        checkpoint.inclusive = True
+        checkpoint.finished = False
+        return checkpoint
+
+    def transfer_data(self):
+        """
+        The transfer process itself. With more than one worker the collection is split into _id ranges which are
+        transferred in separate processes, each with its own connections. Every process writes the parents of a
+        table before the table itself, so the foreign keys are satisfied in every process.
+        With checkpoints enabled the progress is stored after every flush, resume continues from there.
+        Incremental transfers run in a single process and continue from the watermark of the previous run.
+        Afterwards the sink is finished, e.g. a file sink writes its load script.
+        """
+        try:
+            if self.options.checkpoint.incremental_field is not None:
+                self.transfer_partition(self._prepare_incremental_checkpoint())
+            else:
+                self._transfer_partitions([checkpoint for checkpoint in self.prepare_checkpoints()
+                                           if not checkpoint.finished])
+        finally:
+            # a later run has to see the rows written by this one
+            EXISTING_KEY_CACHE.pop(self.checkpoint_name, None)
+        self.sink.finish(self.scheduler.order)
+
+    def _transfer_partitions(self, checkpoints: list[Checkpoint]) -> None:
+        """
+        Transfers the partitions, in worker processes if there is more than one worker
+        :param checkpoints: the checkpoints of the unfinished partitions
+        """
+        if self.options.read.workers == 1 or len(checkpoints) <= 1:
+            for checkpoint in checkpoints:
+                self.transfer_partition(checkpoint)
+            return
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(min(self.options.read.workers, len(checkpoints))) as pool:
+            for _ in pool.imap_unordered(self._transfer_partition_star,
+                                         [(checkpoint, idx % self.options.read.workers)
+                                          for idx, checkpoint in enumerate(checkpoints)]):
+                pass
+
 
+# the deprecated batch_size keeps the signature of earlier versions working
+# pylint: disable-next=too-many-arguments
 def transfer_data_from_mongo_to_postgres(relation_config_dict: dict, mapping_config_path_dict: dict, mongo_host: str,
                                          mongo_database: str, mongo_collection: str,
                                          sql_host: str, sql_database: str, mongo_port: int = None, sql_port: int = None,
                                          sql_user: str = None, sql_password: str = None, mongo_user: str = None,
-                                         mongo_password: str = None, batch_size: int = 1000,
-                                         keep_list_alias_relations: bool = True) -> None:
+                                         mongo_password: str = None, batch_size: int = None,
+                                         keep_list_alias_relations: bool = True,
+                                         options: TransferOptions = None) -> None:
     """
     A wrapper for all the required steps taken for a transfer
     :param relation_config_dict: dict of the relation config file
@@ -226,16 +653,23 @@ def transfer_data_from_mongo_to_postgres(relation_config_dict: dict, mapping_con
     :param sql_password: optional, the password of the user for the target database
     :param mongo_user: optional, the user of the source mongo database
     :param mongo_password: optional, the password of the user for the source database
-    :param batch_size: the batch size used
+    :param batch_size: deprecated, use the batch size of the write options instead
     :param keep_list_alias_relations: Flag if alias relations of lists should be kept. Their information can be
                                             retrieved from aggregating all n:m helper tables
+    :param options: optional, the read, write and checkpoint options of the transfer, e.g. the batch size, the
+                                            number of workers or the sink. With follow_changes set in the checkpoint
+                                            options the change stream of the collection is tailed after the transfer
     """
+    options = resolve_options(options, batch_size)
     relation_builder = RelationBuilder()
     relations = relation_builder.calculate_relations(relation_config_dict, mapping_config_path_dict)
     table_builder = TableBuilder(relations, mapping_config_path_dict, keep_list_alias_relations)
     creation_stmt = table_builder.make_creation_script()
     transferrer = Transferrer(table_builder.get_relations(), mongo_host, mongo_database, mongo_collection, sql_host,
                               sql_database, mongo_port, sql_port, sql_user, sql_password, mongo_user, mongo_password,
-                              batch_size)
+                              options)
     transferrer.prepare_database(creation_stmt)
-    transferrer.transfer_data()
+    if options.checkpoint.follow_changes:
+        ChangeStreamFollower(transferrer).follow()
+    else:
+        transferrer.transfer_data()
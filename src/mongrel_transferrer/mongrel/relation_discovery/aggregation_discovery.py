@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import pymongo
+from tqdm import tqdm
+
+from ..helpers.types.column_info import ColumnInfo
+from ..helpers.types.data_type import Datatype
+
+BSON_DATATYPES = {"bool": Datatype.BOOLEAN, "int": Datatype.INTEGER, "long": Datatype.INTEGER,
+                  "double": Datatype.FLOAT, "string": Datatype.TEXT}
+# the $type aliases of the values that are not grouped on
+NESTED_TYPES = ["object", "array"]
+
+
+class AggregationDiscovery:
+    """
+    Discovers the tables with aggregation pipelines that run in mongo, only the statistics of the fields are sent
+    back instead of the documents. Every table takes one pipeline that counts the values and the distinct values of
+    its fields, the values are exact instead of bloom filter estimates.
+    """
+
+    @staticmethod
+    def scalar_fields(expression: object) -> dict:
+        """
+        Builds the expression that reduces a subdocument to its scalar fields. Grouping on whole subdocuments makes
+        mongo compare every nested value, their scalar fields identify them as well.
+        :param expression: the expression of the subdocument, e.g. "$doc"
+        :return: the expression of the subdocument without its subdocuments and lists
+        """
+        return {"$arrayToObject": {"$filter": {"input": {"$objectToArray": expression}, "as": "kv",
+                                               "cond": {"$not": [{"$in": [{"$type": "$$kv.v"}, NESTED_TYPES]}]}}}}
+
+    @staticmethod
+    def build_pipeline(path: list[str], sample_ids: list = None) -> list[dict]:
+        """
+        Builds the pipeline that collects the statistics of all fields of the (sub)documents at path. Lists are
+        unwound like the python discovery does, a subdocument that appears more than once is counted once.
+        Subdocuments are grouped by their scalar fields only.
+        :param path: the keys leading to the subdocuments, empty for the documents of the collection
+        :param sample_ids: optional, the _ids of the sampled documents the statistics are collected from
+        :return: the pipeline, it returns one document per field
+        """
+        pipeline = [{"$match": {"_id": {"$in": sample_ids}}}] if sample_ids is not None else []
+        pipeline.append({"$project": {"_id": 0, "doc": "$$ROOT"}})
+        for key in path:
+            pipeline += [{"$project": {"doc": f"$doc.{key}"}}, {"$unwind": "$doc"}]
+        if path:
+            pipeline += [{"$match": {"doc": {"$type": "object"}}},
+                         {"$group": {"_id": AggregationDiscovery.scalar_fields("$doc"), "doc": {"$first": "$doc"}}},
+                         {"$project": {"_id": 0, "doc": 1}}]
+        pipeline += [
+            {"$project": {"kv": {"$objectToArray": "$doc"}}},
+            {"$unwind": "$kv"},
+            {"$project": {"k": "$kv.k", "v": "$kv.v", "list": {"$isArray": "$kv.v"}}},
+            # null values and empty lists are dropped here, the python discovery skips them as well
+            {"$unwind": "$v"},
+            {"$group": {"_id": {"k": "$k", "v": {"$cond": [{"$eq": [{"$type": "$v"}, "object"]},
+                                                         AggregationDiscovery.scalar_fields("$v"), "$v"]}},
+                        "n": {"$sum": 1},
+                        "list": {"$max": "$list"},
+                        "type": {"$first": {"$type": "$v"}},
+                        "length": {"$max": {"$cond": [{"$eq": [{"$type": "$v"}, "string"]},
+                                                      {"$strLenCP": "$v"}, 0]}}}},
+            {"$group": {"_id": "$_id.k",
+                        "distinct": {"$sum": 1},
+                        "total": {"$sum": "$n"},
+                        "list": {"$max": "$list"},
+                        "types": {"$addToSet": "$type"},
+                        "length": {"$max": "$length"}}},
+            {"$sort": {"_id": 1}},
+        ]
+        return pipeline
+
+    @staticmethod
+    def get_data_type(types: list[str]) -> Datatype:
+        """
+        Maps the $type aliases of a field to the datatype the python discovery would have found
+        :param types: the aliases of all values of the field
+        :return: the widest datatype of the values
+        """
+        data_type = Datatype.BOOLEAN
+        for alias in types:
+            candidate = BSON_DATATYPES.get(alias, Datatype.NOT_ADAPTABLE)
+            if candidate.value > data_type.value:
+                data_type = candidate
+        return data_type
+
+    @staticmethod
+    def discover_table(collection: pymongo.collection.Collection, path: list[str],
+                       sample_ids: list = None) -> dict:
+        """
+        Runs the pipeline of one table and turns the statistics into column infos
+        :param collection: the source collection
+        :param path: the keys leading to the subdocuments of the table, empty for the collection itself
+        :param sample_ids: optional, the _ids of the sampled documents
+        :return: the columns of the table
+        """
+        columns = {}
+        for stats in collection.aggregate(AggregationDiscovery.build_pipeline(path, sample_ids), allowDiskUse=True):
+            key = stats["_id"]
+            types = stats["types"]
+            column_info = ColumnInfo(0, is_table="object" in types, is_list=bool(stats["list"]), path=path + [key],
+                                     datatype=AggregationDiscovery.get_data_type(types), length=stats["length"])
+            column_info.unique = stats["distinct"] == stats["total"]
+            column_info.set_counts(stats["distinct"], stats["total"])
+            columns[key] = column_info
+        candidates = [col for _, col in columns.items() if not col.is_table]
+        if candidates and not any(col.unique for _, col in columns.items()):
+            # preserve last pk candidate, the column with the fewest repeated values
+            candidate = max(candidates, key=lambda col: col.distinct_ratio())
+            candidate.unique = True
+            candidate.locked = True
+        return columns
+
+    @staticmethod
+    def discover_tables(collection: pymongo.collection.Collection, sample_size: int = None) -> dict:
+        """
+        Discovers the tables of the collection and of all its subdocuments, one pipeline per table. The result has
+        the same structure as the tables of the python discovery.
+        :param collection: the source collection
+        :param sample_size: optional, the number of randomly sampled documents. The sample is drawn once and every
+        pipeline reads the same documents, so the statistics of the tables fit together
+        :return: the tables dictionary
+        """
+        sample_ids = None
+        if sample_size:
+            # $sample may return a document more than once, $in matches it once anyway
+            sample_ids = [doc["_id"] for doc in collection.aggregate([{"$sample": {"size": sample_size}},
+                                                                      {"$project": {"_id": 1}}], allowDiskUse=True)]
+        tables = {}
+        pending = [[]]
+        with tqdm(desc="tables") as progress:
+            while pending:
+                path = pending.pop(0)
+                columns = AggregationDiscovery.discover_table(collection, path, sample_ids)
+                tables['.'.join(path) if path else collection.name] = {"columns": columns}
+                # keys with dots or dollars can't be used in field paths, their subdocuments are not discovered
+                pending += [column_info.path for _, column_info in columns.items() if column_info.is_table
+                            and "." not in column_info.path[-1] and not column_info.path[-1].startswith("$")]
+                progress.update()
+        return tables
@@ -8,6 +8,9 @@ from ..helpers.types.data_type import Datatype
 from ..helpers.types.relation_type import RelationType
 from .relation_discovery import RelationDiscovery
 
+# distinct ratios above this are within the error of the sketches, the datatype decides between such candidates
+CARDINALITY_TIE_RATIO = 0.95
+
 
 class ConfigurationBuilder:
 
@@ -22,7 +25,7 @@ class ConfigurationBuilder:
         return 'n:m'
 
     @staticmethod
-    def choose_primary_key_candidate(column_infos: dict):
+    def choose_primary_key_candidate(column_infos: dict, cardinalities: dict = None):
         # Helper function to parse SQL data types
         def parse_sql_type(sql_type):
             if 'varchar' in sql_type or 'character varying' in sql_type:
@@ -59,23 +62,27 @@ class ConfigurationBuilder:
                 score += 1  # Then floats and numerics
 
             # No additional scores for other types
-            candidate_scores.append((name, score))
-        # Sort candidates by score in descending order
+            ratio = cardinalities.get(name, 1.0) if cardinalities else 1.0
+            candidate_scores.append((name, (min(ratio, CARDINALITY_TIE_RATIO), score)))
+        # Sort candidates by cardinality and score in descending order
         candidate_scores.sort(key=lambda x: x[1], reverse=True)
         if not candidate_scores:
             raise ValueError("No suitable primary key candidates found.")
         return candidate_scores[0][0]  # Return the highest scoring candidate
 
     @staticmethod
-    def build_configuration(collection: pymongo.collection.Collection, schema_name: str = "public", cutoff=1.0) -> \
-            tuple[dict, dict]:
-        relation_info = RelationDiscovery.get_relation_info(collection, cutoff)
+    def build_configuration(collection: pymongo.collection.Collection, schema_name: str = "public", cutoff=1.0,
+                            workers: int = 1, sample_size: int = None, pushdown: bool = False,
+                            duplicate_tolerance: float = 0.0, memory_budget: int = None) -> tuple[dict, dict]:
+        relation_info = RelationDiscovery.get_relation_info(collection, cutoff, workers, sample_size, pushdown,
+                                                            duplicate_tolerance, memory_budget)
         mappings = {}
         relations = {}
         for table, info in relation_info.items():
             table_name = f'{schema_name}.{table.replace(".", "_")}'
             mappings[table_name] = {'transfer_options': {'reference_keys': {}}}
             pk_candidates = {}
+            cardinalities = {}
             for name, column_info in info['columns'].items():
                 if not column_info.is_table and not column_info.is_list:
                     sql_definition = column_info.data_type.name
@@ -90,8 +97,9 @@ class ConfigurationBuilder:
                     mappings[table_name]['.'.join(column_info.path)] = f'{name} {sql_definition}'
                     if column_info.unique or len(info["columns"]) == 1:
                         pk_candidates[name] = sql_definition
+                        cardinalities[name] = column_info.distinct_ratio()
             mappings[table_name]['transfer_options']['reference_keys'][
-                ConfigurationBuilder.choose_primary_key_candidate(pk_candidates)] = "PK"
+                ConfigurationBuilder.choose_primary_key_candidate(pk_candidates, cardinalities)] = "PK"
             relations[table_name] = {}
             for relation in info['relations']:
                 relation_type_str = ConfigurationBuilder._interpret_relation_type(relation.relation_type)
@@ -1,18 +1,127 @@
 from __future__ import annotations
 
+import math
+import multiprocessing
+import multiprocessing.queues
+import queue
+import threading
+from collections.abc import Iterator
+
+import bson
+import mmh3
 import pymongo
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from tqdm import tqdm
 
+from ..helpers.mongo_functions import compute_id_partitions, sample_documents
+from ..helpers.types.bloom_filter import HASH_SEED, MemoryBudget
 from ..helpers.types.column_info import ColumnInfo
 from ..helpers.types.relation_type import RelationType
 from ..helpers.types.relation import Relation
+from .aggregation_discovery import AggregationDiscovery
+
+DOCUMENT_CHUNK_SIZE = 256
+WORKER_QUEUE_SIZE = 16
+WORKER_TIMEOUT = 1.0
+
+
+def _discover_part(worker: int, base_name: str, expected_values: int, documents: multiprocessing.queues.Queue,
+                   results: multiprocessing.queues.Queue, memory_budget: int = None) -> None:
+    """
+    Runs in a worker process of the parallel discovery. Processes the chunks of raw documents it receives until None
+    arrives and sends back its tables.
+    :param worker: the index of the worker
+    :param base_name: the name of the collection
+    :param expected_values: amount of expected values to create the bloom filters
+    :param documents: the queue the chunks of raw documents arrive in
+    :param results: the queue the tables or the raised exception are sent back with
+    :param memory_budget: optional, the bytes the bloom filters of this worker may take
+    """
+    tables = {base_name: {"columns": {}}}
+    processed = {}
+    budget = MemoryBudget(memory_budget)
+    failure = None
+    while True:
+        chunk = documents.get()
+        if chunk is None:
+            break
+        if failure is not None:
+            # keep draining so the readers are not blocked
+            continue
+        try:
+            for raw in chunk:
+                tables, processed = RelationDiscovery.process_document(bson.decode(raw), tables, base_name,
+                                                                       expected_values, processed, budget=budget,
+                                                                       keep_hashes=True)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            failure = error
+    if failure is not None:
+        results.put((worker, failure))
+    else:
+        RelationDiscovery.report_budget(budget)
+        results.put((worker, RelationDiscovery.flush_tables(tables)))
+
+
+def _put_chunk(documents: multiprocessing.queues.Queue, process: multiprocessing.Process, chunk: list) -> None:
+    """
+    Sends a chunk to a worker, waits as long as the worker is alive
+    :param documents: the queue of the worker
+    :param process: the worker process
+    :param chunk: the chunk of raw documents, None stops the worker
+    """
+    while True:
+        try:
+            documents.put(chunk, timeout=WORKER_TIMEOUT)
+            return
+        except queue.Full as full:
+            if not process.is_alive():
+                raise RuntimeError("A discovery worker stopped unexpectedly") from full
+
+
+def _read_source(source: Iterator, idx: int, queues: list[multiprocessing.queues.Queue],
+                 processes: list[multiprocessing.Process], progress: tqdm, errors: list[BaseException]) -> None:
+    """
+    Runs in a reader thread of the parallel discovery. Reads the raw documents of a source and sends them in chunks
+    to the workers, round robin. Only reading the cursor and sending the chunks can fail, the errors are collected.
+    :param source: the cursor of the source
+    :param idx: the index of the source, the first chunk goes to this worker
+    :param queues: the queues of the workers
+    :param processes: the worker processes
+    :param progress: the progress bar
+    :param errors: the list the raised exceptions are appended to
+    """
+    documents = iter(source)
+    chunk = []
+    while True:
+        try:
+            doc = next(documents, None)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            errors.append(error)
+            return
+        if doc is not None:
+            chunk.append(doc.raw)
+        if chunk and (doc is None or len(chunk) >= DOCUMENT_CHUNK_SIZE):
+            worker = idx % len(queues)
+            try:
+                _put_chunk(queues[worker], processes[worker], chunk)
+            except RuntimeError as error:
+                errors.append(error)
+                return
+            progress.update(len(chunk))
+            idx += 1
+            chunk = []
+        if doc is None:
+            return
 
 
 class RelationDiscovery:
 
     @staticmethod
     def process_document(document: dict, tables: dict, base_name: str, expected_values: int,
-                         processed: dict = None, current_path: list = None) -> tuple[dict, dict]:
+                         processed: dict = None, current_path: list = None,
+                         budget: MemoryBudget = None, digests: dict = None,
+                         keep_hashes: bool = False) -> tuple[dict, dict]:
         """
         This function calculates for all values if they are unique and whether the values of underlying documents
         are unique. The final structure looks as follows:
@@ -32,12 +141,18 @@ class RelationDiscovery:
         :param expected_values: amount of expected values to create the bloom filters
         :param processed: dictionary that contains all processed documents
         :param current_path: the path of the current subdocument, required for dynamic programming
+        :param budget: optional, the memory budget shared by all bloom filters
+        :param digests: the digests of the subdocuments of the current document, by their id
+        :param keep_hashes: if True the columns keep the hash pairs of their values while they are unique, the
+        discovery workers need them to merge their parts
         :return:
         """
         if processed is None:
             processed = {}
         if current_path is None:
             current_path = []
+        if digests is None:
+            digests = {}
         for key, item in document.items():
             path = current_path + [key]
             path_str = '.'.join(path)
@@ -45,46 +160,105 @@ class RelationDiscovery:
                 if path_str not in tables:
                     tables[path_str] = {"columns": {}}
                 if key not in tables[base_name]["columns"]:
-                    tables[base_name]["columns"][key] = ColumnInfo(expected_values, is_table=True,
-                                                                   path=path)
+                    tables[base_name]["columns"][key] = ColumnInfo(expected_values, is_table=True, path=path,
+                                                                   budget=budget, keep_hashes=keep_hashes)
                 if key not in processed:
-                    processed[key] = ColumnInfo(expected_values, is_table=True, path=path)
+                    processed[key] = ColumnInfo(expected_values, is_table=True, path=path, budget=budget)
                 tables[base_name]["columns"][key].is_table = True
-                tables[base_name]["columns"][key].add_value(item)
-                if item not in processed[key]:
-                    processed[key].add_value(item)
+                digest = RelationDiscovery.digest(item, digests)
+                if tables[base_name]["columns"][key].queue_value(item, digest):
+                    RelationDiscovery.flush_table(tables[base_name]["columns"])
+                if not processed[key].add_value(item, digest):
                     tables, processed = RelationDiscovery.process_document(item, tables, path_str, expected_values,
-                                                                           processed, current_path=path)
+                                                                           processed, current_path=path,
+                                                                           budget=budget, digests=digests,
+                                                                           keep_hashes=keep_hashes)
             elif isinstance(item, list):
                 if key not in tables[base_name]["columns"]:
-                    factor = 1
-                    if len(item) > 0:
-                        factor = len(item)
-                    tables[base_name]["columns"][key] = ColumnInfo(factor * expected_values, is_list=True,
-                                                                   path=path)
+                    # the filters grow with the values, so lists need no larger initial filter
+                    tables[base_name]["columns"][key] = ColumnInfo(expected_values, is_list=True, path=path,
+                                                                   budget=budget, keep_hashes=keep_hashes)
                 for list_item in item:
                     tables, processed = RelationDiscovery.process_document({key: list_item}, tables, base_name,
                                                                            expected_values, processed,
-                                                                           current_path=current_path)
+                                                                           current_path=current_path, budget=budget,
+                                                                           digests=digests, keep_hashes=keep_hashes)
             elif item is not None:
                 if key not in tables[base_name]["columns"]:
-                    tables[base_name]["columns"][key] = ColumnInfo(expected_values, path=path)
-                col_info = tables[base_name]["columns"][key]
-                was_unique = col_info.unique
-                not_unique = tables[base_name]["columns"][key].add_value(item)
-                if was_unique and not col_info.locked and not_unique:
-                    # preserve last pk candidate
-                    ok = False
-                    for _, col in tables[base_name]["columns"].items():
-                        if col.unique:
-                            ok = True
-                            break
-                    if not ok:
-                        col_info.unique = True
-                        col_info.locked = True
+                    tables[base_name]["columns"][key] = ColumnInfo(expected_values, path=path, budget=budget,
+                                                                   keep_hashes=keep_hashes)
+                if tables[base_name]["columns"][key].queue_value(item):
+                    RelationDiscovery.flush_table(tables[base_name]["columns"])
 
         return tables, processed
 
+    @staticmethod
+    def digest(value: object, cache: dict) -> object:
+        """
+        Computes a structural digest of a value. The digest of a subdocument does not depend on the order of its keys
+        and is computed from the digests of its fields, so every subdocument is hashed once per document walk.
+        :param value: the value to digest
+        :param cache: the digests of the subdocuments of the current document by their id, the documents have to stay
+        alive while the cache is used
+        :return: a 128-bit integer for subdocuments and lists, the repr of other values
+        """
+        if isinstance(value, dict):
+            if id(value) in cache:
+                return cache[id(value)]
+            fields = sorted(f"{key!r}:{RelationDiscovery.digest(item, cache)}" for key, item in value.items())
+            digest = mmh3.hash128("d" + "\x1f".join(fields), HASH_SEED, signed=False)
+            cache[id(value)] = digest
+            return digest
+        if isinstance(value, list):
+            items = [str(RelationDiscovery.digest(item, cache)) for item in value]
+            return mmh3.hash128("l" + "\x1f".join(items), HASH_SEED, signed=False)
+        return repr(value)
+
+    @staticmethod
+    def report_budget(budget: MemoryBudget) -> None:
+        if budget.exhausted:
+            print(f"The memory budget of {budget.limit} bytes was used up, the bloom filters stopped growing and "
+                  "some columns may be wrongly treated as not unique")
+
+    @staticmethod
+    def is_key_column(column_info: ColumnInfo) -> bool:
+        """
+        :param column_info: the column
+        :return: True if the column holds scalar values and can become the primary key of its table
+        """
+        return not column_info.is_table and not column_info.is_list
+
+    @staticmethod
+    def flush_table(columns: dict) -> None:
+        """
+        Adds the queued values of all columns of a table to their bloom filters. The columns are flushed together,
+        so no column still looks unique because its repeated values are queued. If no scalar column of the table
+        stays unique, the column with the most distinct values among those that just lost it stays unique and gets
+        locked, so the table keeps a primary key candidate.
+        :param columns: all columns of the table
+        """
+        lost = []
+        for _, col_info in columns.items():
+            was_unique = col_info.unique
+            if col_info.flush_values() and was_unique and RelationDiscovery.is_key_column(col_info):
+                lost.append(col_info)
+        if lost and not any(col.unique for _, col in columns.items() if RelationDiscovery.is_key_column(col)):
+            # preserve last pk candidate
+            candidate = max(lost, key=lambda col: col.distinct_ratio())
+            candidate.unique = True
+            candidate.locked = True
+
+    @staticmethod
+    def flush_tables(tables: dict) -> dict:
+        """
+        Flushes the queued values of all columns
+        :param tables: the tables dictionary
+        :return: the tables dictionary with all values in the bloom filters
+        """
+        for _, table in tables.items():
+            RelationDiscovery.flush_table(table["columns"])
+        return tables
+
     @staticmethod
     def has_same_columns(columns: list[str], to_comp: dict) -> bool:
         if len(columns) != len(to_comp):
@@ -99,7 +273,20 @@ class RelationDiscovery:
                 yield key
 
     @staticmethod
-    def interpret_value_appearances(tables: dict) -> dict[str, list[Relation]]:
+    def is_unique(column_info: ColumnInfo, duplicate_tolerance: float = 0.0) -> bool:
+        """
+        Decides whether the values of a column count as unique for the relations
+        :param column_info: the column
+        :param duplicate_tolerance: the share of repeated values that is still treated as unique, by the estimated
+        number of distinct values. 0 only trusts the bloom filter.
+        :return: True if the column counts as unique
+        """
+        if column_info.unique:
+            return True
+        return duplicate_tolerance > 0 and 1 - column_info.distinct_ratio() <= duplicate_tolerance
+
+    @staticmethod
+    def interpret_value_appearances(tables: dict, duplicate_tolerance: float = 0.0) -> dict[str, list[Relation]]:
         dict_of_relations = {}
         for key, item in tables.items():
             if key not in dict_of_relations:
@@ -107,12 +294,13 @@ class RelationDiscovery:
             for column_name, column_info in item["columns"].items():
                 right_name = column_name if len(column_info.path) <= 1 else '.'.join(column_info.path)
                 if column_info.is_table and right_name in tables:
+                    unique = RelationDiscovery.is_unique(column_info, duplicate_tolerance)
                     if column_info.is_list:
-                        if column_info.unique:
+                        if unique:
                             dict_of_relations[key].append(Relation(key, right_name, RelationType.r_1ton))
                         else:
                             dict_of_relations[key].append(Relation(key, right_name, RelationType.r_ntom))
-                    elif column_info.unique:
+                    elif unique:
                         dict_of_relations[key].append(Relation(key, right_name, RelationType.r_1to1))
                     else:
                         dict_of_relations[key].append(Relation(key, right_name, RelationType.r_nto1))
@@ -169,23 +357,141 @@ class RelationDiscovery:
         return tables
 
     @staticmethod
-    def get_relation_info(collection: pymongo.collection.Collection, cutoff=1.0) -> dict:
+    def merge_tables(parts: list[dict]) -> dict:
+        """
+        Merges the tables discovered in different parts of the collection. If no column of a merged table stays
+        unique, a column that was kept as the last primary key candidate in one of the parts is kept again.
+        :param parts: the flushed tables of every part
+        :return: the tables of the whole collection
+        """
+        merged = {}
+        for tables in parts:
+            for name, table in tables.items():
+                if name not in merged:
+                    merged[name] = table
+                    continue
+                columns = merged[name]["columns"]
+                for key, column_info in table["columns"].items():
+                    if key in columns:
+                        columns[key].merge(column_info)
+                    else:
+                        columns[key] = column_info
+        for _, table in merged.items():
+            columns = table["columns"]
+            keys = [col for _, col in columns.items() if RelationDiscovery.is_key_column(col)]
+            if columns and not any(col.unique for col in keys):
+                candidates = [col for col in keys if col.locked] + keys
+                if candidates:
+                    candidates[0].unique = True
+                    candidates[0].locked = True
+        return merged
+
+    @staticmethod
+    def discover_parallel(collection: pymongo.collection.Collection, expected: int, cutoff: float,
+                          workers: int, sample_size: int = None, memory_budget: int = None) -> dict:
+        """
+        Discovers the tables in worker processes. The collection is read in _id partitions by reader threads, the
+        raw documents are decoded and processed in the workers, each building its own tables. The tables of the
+        workers are merged at the end.
+        :param collection: the collection to discover
+        :param expected: amount of expected values to create the bloom filters
+        :param cutoff: the share of the documents that is read
+        :param workers: the number of worker processes
+        :param sample_size: optional, the size of the random sample that is read instead of the partitions
+        :param memory_budget: optional, the bytes the bloom filters of all workers may take, split evenly
+        :return: the merged tables
+        """
+        raw_collection = collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+        if sample_size:
+            sources = [sample_documents(raw_collection, sample_size)]
+        else:
+            queries = compute_id_partitions(collection, workers)
+            limit = math.ceil(cutoff * expected / len(queries)) if cutoff < 1 else 0
+            sources = [raw_collection.find(query, limit=limit) for query in queries]
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        queues = [context.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers)]
+        processes = [context.Process(target=_discover_part,
+                                     args=(idx, collection.name, expected, documents, results,
+                                           memory_budget // workers if memory_budget else None),
+                                     daemon=True) for idx, documents in enumerate(queues)]
+        for process in processes:
+            process.start()
+        progress = tqdm(total=expected)
+        errors = []
+        readers = [threading.Thread(target=_read_source, args=(source, idx, queues, processes, progress, errors),
+                                    daemon=True) for idx, source in enumerate(sources)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        for documents, process in zip(queues, processes):
+            _put_chunk(documents, process, None)
+        parts = []
+        while len(parts) < workers:
+            try:
+                parts.append(results.get(timeout=WORKER_TIMEOUT))
+            except queue.Empty as empty:
+                if not any(process.is_alive() for process in processes) and results.empty():
+                    raise RuntimeError("A discovery worker stopped unexpectedly") from empty
+        parts.sort(key=lambda part: part[0])
+        for process in processes:
+            process.join()
+        progress.close()
+        if errors:
+            raise errors[0]
+        for _, part in parts:
+            if isinstance(part, BaseException):
+                raise part
+        return RelationDiscovery.merge_tables([part for _, part in parts])
+
+    @staticmethod
+    def get_relation_info(collection: pymongo.collection.Collection, cutoff=1.0, workers: int = 1,
+                          sample_size: int = None, pushdown: bool = False, duplicate_tolerance: float = 0.0,
+                          memory_budget: int = None) -> dict:
+        if pushdown:
+            # the statistics are collected by mongo, the cutoff and the workers don't apply
+            return RelationDiscovery.finish_tables(AggregationDiscovery.discover_tables(collection, sample_size),
+                                                   duplicate_tolerance)
         if cutoff < 0 or cutoff > 1:
             cutoff = 1.0
-        tables = {collection.name: {"columns": {}}}
+        if sample_size:
+            # the filters only need to hold the sampled values, the estimate avoids counting the collection
+            expected = min(sample_size, collection.estimated_document_count())
+            cutoff = 1.0
+        else:
+            expected = collection.count_documents({})
+        if workers > 1:
+            tables = RelationDiscovery.discover_parallel(collection, expected, cutoff, workers, sample_size,
+                                                         memory_budget)
+        else:
+            tables = {collection.name: {"columns": {}}}
+            processed = {}
+            budget = MemoryBudget(memory_budget)
+            counter = 0
+            documents = sample_documents(collection, sample_size) if sample_size else collection.find()
+            for doc in tqdm(documents, total=expected):
+                counter += 1
+                tables, processed = RelationDiscovery.process_document(doc, tables, collection.name, expected,
+                                                                       processed, budget=budget)
+                if cutoff < 1 and counter > cutoff * expected:
+                    break
+            tables = RelationDiscovery.flush_tables(tables)
+            RelationDiscovery.report_budget(budget)
+        return RelationDiscovery.finish_tables(tables, duplicate_tolerance)
+
+    @staticmethod
+    def finish_tables(tables: dict, duplicate_tolerance: float = 0.0) -> dict:
+        """
+        Turns the discovered column statistics into the final tables including their relations and aliases
+        :param tables: the tables dictionary with the statistics of all columns
+        :param duplicate_tolerance: the share of repeated subdocuments that still counts as unique
+        :return: the tables dictionary the configuration is built from
+        """
         rellie = RelationDiscovery()
-        processed = {}
-        expected = collection.count_documents({})
-        counter = 0
-        for doc in tqdm(collection.find()):
-            counter += 1
-            tables, processed = rellie.process_document(doc, tables, collection.name, expected,
-                                                        processed)
-            if cutoff < 1 and counter > cutoff * expected:
-                break
         tables = RelationDiscovery._add_lists(tables)
         tables = RelationDiscovery._remove_empty_tables(tables)
-        relations = rellie.interpret_value_appearances(tables)
+        relations = rellie.interpret_value_appearances(tables, duplicate_tolerance)
         for key, relations in relations.items():
             tables[key]["relations"] = relations
         tables = RelationDiscovery.handle_doubles(tables)
@@ -0,0 +1,39 @@
+from mongrel_transferrer.mongrel.relation_discovery.aggregation_discovery import AggregationDiscovery
+
+
+class RecordingCollection:
+    """
+    Records the pipelines that are run. The sample returns fixed _ids, the documents have an id and an album
+    subdocument with an id
+    """
+    name = "tracks"
+
+    def __init__(self):
+        self.pipelines = []
+
+    def aggregate(self, pipeline: list[dict], **_kwargs) -> list[dict]:
+        self.pipelines.append(pipeline)
+        if "$sample" in pipeline[0]:
+            return [{"_id": 1}, {"_id": 2}, {"_id": 1}]
+        stats = {"distinct": 2, "total": 2, "list": False, "length": 0}
+        columns = [{"_id": "id", "types": ["int"], **stats}]
+        if {"$unwind": "$doc"} not in pipeline:
+            columns.append({"_id": "album", "types": ["object"], **stats})
+        return columns
+
+
+def test_every_pipeline_reads_the_same_sample():
+    collection = RecordingCollection()
+    tables = AggregationDiscovery.discover_tables(collection, sample_size=2)
+    assert list(tables) == ["tracks", "album"]
+    samples = [pipeline for pipeline in collection.pipelines if "$sample" in pipeline[0]]
+    assert len(samples) == 1
+    for pipeline in collection.pipelines[1:]:
+        assert pipeline[0] == {"$match": {"_id": {"$in": [1, 2, 1]}}}
+
+
+def test_subdocuments_are_grouped_on_their_scalar_fields():
+    pipeline = AggregationDiscovery.build_pipeline(["album"])
+    groups = [stage["$group"]["_id"] for stage in pipeline if "$group" in stage]
+    assert groups[0] == AggregationDiscovery.scalar_fields("$doc")
+    assert groups[1]["v"]["$cond"][1] == AggregationDiscovery.scalar_fields("$v")
@@ -0,0 +1,41 @@
+import numpy
+import pytest
+
+from mongrel_transferrer.mongrel.helpers.types.bloom_filter import BloomFilter, ScalableBloomFilter
+from mongrel_transferrer.mongrel.helpers.types.column_info import VALUE_BATCH_SIZE
+
+
+def fill(bloom_filter: ScalableBloomFilter, values: list[str]) -> int:
+    """
+    Adds distinct values in the batches of the discovery
+    :param bloom_filter: the filter to fill
+    :param values: the distinct values
+    :return: the number of values that were wrongly reported as contained
+    """
+    false_positives = 0
+    for start in range(0, len(values), VALUE_BATCH_SIZE):
+        false_positives += int(bloom_filter.check_and_add_many(values[start:start + VALUE_BATCH_SIZE]).sum())
+    return false_positives
+
+
+@pytest.mark.parametrize("acceptance", [0.001, 0.0000001])
+def test_false_positive_rate_stays_below_the_acceptance(acceptance):
+    values = [f"value-{idx}" for idx in range(200000)]
+    others = [f"other-{idx}" for idx in range(200000)]
+    bloom_filter = ScalableBloomFilter(len(values), acceptance)
+    false_positives = fill(bloom_filter, values) + int(bloom_filter.check_many(others).sum())
+    assert len(bloom_filter.slices) > 1
+    assert false_positives <= (len(values) + len(others)) * acceptance
+    assert bloom_filter.check_many(values).all()
+
+
+def test_every_slice_sets_distinct_bits():
+    bloom_filter = ScalableBloomFilter(1000000, 0.000000001)
+    while len(bloom_filter.slices) < 6:
+        bloom_filter._add_slice()
+    pairs = BloomFilter.hash_pairs([f"value-{idx}" for idx in range(20000)])
+    for part in bloom_filter.slices:
+        positions = part.hash_many(None, pairs)
+        distinct = numpy.array([len(set(row)) for row in positions.tolist()])
+        assert distinct.min() >= part.hash_functions - 2
+        assert list(part.positions(tuple(int(value) for value in pairs[0]))) == positions[0].tolist()
@@ -0,0 +1,80 @@
+import math
+import re
+from types import SimpleNamespace
+
+from mongrel_transferrer.mongrel.helpers.database_functions import copy_on_conflict_nothing, to_copy_value
+
+ROWS = [("plain", 1, 2.5), ("tab\there", None, math.nan), ("back\\slash", 7.0, -0.0),
+        ("line\nbreak\r", 0, 1e20), ("\\N", -3, 0.1), ("", True, None), ("\\.", False, 3.0), ("unicode ü €", 2, 1.5)]
+ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def read_copy_text(text: str) -> list[list]:
+    """
+    Reads the text format of COPY ... FROM the way postgres does, \\N fields are null
+    :param text: the streamed data
+    :return: the rows as lists of strings and None
+    """
+    def unescape(match: re.Match) -> str:
+        escaped = match.group(1)
+        if escaped[0] in ESCAPES:
+            return ESCAPES[escaped[0]]
+        if escaped[0] in "01234567":
+            return chr(int(escaped, 8))
+        if escaped[0] == "x" and len(escaped) > 1:
+            return chr(int(escaped[1:], 16))
+        return escaped
+
+    rows = []
+    for line in text.split("\n")[:-1]:
+        rows.append([None if field == "\\N" else re.sub(r"\\([0-7]{1,3}|x[0-9a-fA-F]{1,2}|.)", unescape, field)
+                     for field in line.split("\t")])
+    return rows
+
+
+def expected_text(value: object) -> object:
+    """
+    :param value: a written value
+    :return: the text postgres should read for it
+    """
+    if value is None or isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class FakeCursor:
+    """
+    Keeps the data streamed with COPY
+    """
+
+    def __init__(self):
+        self.copied = None
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        return False
+
+    def execute(self, _statement: str) -> None:
+        pass
+
+    def copy_expert(self, _statement: str, buffer) -> None:
+        self.copied = buffer.read()
+
+
+def test_copy_values_round_trip():
+    for row in ROWS:
+        for value in row:
+            assert read_copy_text(to_copy_value(value) + "\n") == [[expected_text(value)]]
+
+
+def test_copied_rows_round_trip():
+    cursor = FakeCursor()
+    table = SimpleNamespace(table=SimpleNamespace(name="tracks", schema="music"))
+    connection = SimpleNamespace(connection=SimpleNamespace(cursor=lambda: cursor))
+    copy_on_conflict_nothing(table, connection, ["name", "count", "score"], iter(ROWS))
+    assert read_copy_text(cursor.copied) == [[expected_text(value) for value in row] for row in ROWS]
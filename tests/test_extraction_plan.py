@@ -0,0 +1,86 @@
+import copy
+import random
+
+from mongrel_transferrer.mongrel.helpers.constants import PATH_SEP
+from mongrel_transferrer.mongrel.helpers.map_flattener import flatten
+from mongrel_transferrer.mongrel.objects.extraction_plan import ExtractionPlan, SharedExtractionPlan
+from mongrel_transferrer.mongrel.objects.relation_builder import RelationBuilder
+from mongrel_transferrer.mongrel.objects.table import Field, Table
+from mongrel_transferrer.mongrel.objects.table_builder import TableBuilder
+
+# the mappings are parsed from json configurations, so they stay dictionaries here
+# pylint: disable-next=consider-using-namedtuple-or-dataclass
+MAPPINGS = {"s.t": {"a.b": "b INTEGER", "a.c.d": "d INTEGER", "e.f": "f INTEGER", "g": "g INTEGER",
+                    "transfer_options": {"reference_keys": {"b": "PK"}}},
+            "s.u": {"a.c.d": "d2 INTEGER", "h": "h INTEGER"},
+            "s.v": {"a.c.d": "d INTEGER", "a.b": "b INTEGER", "e": "e INTEGER",
+                    "transfer_options": {"reference_keys": {"d": "PK"}}}}
+RELATIONS = {"s.t": {"n:m": {"s.v": {}}}, "s.u": {}}
+
+
+# the shape of the documents, subdocuments are dicts and None marks a scalar leaf
+SHAPE = {"a": {"b": None, "c": {"d": None}}, "e": {"f": None}, "g": None, "h": None}
+
+
+def random_value(rng: random.Random, shape: dict = None, in_list: bool = False) -> object:
+    """
+    :param rng: the random generator
+    :param shape: the shape of the value, None for a scalar
+    :param in_list: if True the value is an item of a list and not a list itself
+    :return: a value of that shape or a list of them, keys may be missing and values may be null
+    """
+    choice = rng.random()
+    if choice < 0.1:
+        return None
+    if choice < 0.35 and not in_list:
+        return [random_value(rng, shape, True) for _ in range(rng.randint(0, 3))]
+    if shape is None:
+        return rng.randint(0, 3)
+    return {key: random_value(rng, child) for key, child in shape.items() if rng.random() < 0.7}
+
+
+def filter_dict(doc: object, relation: Table, layer: int = 0) -> object:
+    """
+    Keeps the paths of the relation's columns, like the transfer did before the extraction plans
+    """
+    if isinstance(doc, dict):
+        return {key: filter_dict(doc[key], relation, layer + 1) for key in doc
+                if any(col.path is not None and len(col.path) > layer and key == col.path[layer]
+                       for col in relation.columns)}
+    if isinstance(doc, list):
+        return [filter_dict(entry, relation, layer) for entry in doc]
+    return doc
+
+
+def flattened_rows(doc: dict, relation: Table, columns: list[str]) -> list[tuple]:
+    """
+    Extracts the rows of a relation with map_flattener.flatten
+    :return: the rows in the column order, rows without a primary key or without any value are dropped
+    """
+    rows = []
+    for flat in flatten(filter_dict(doc, relation), path_separator=PATH_SEP):
+        if any(flat.get(col.translated_path) is None for col in relation.columns
+               if col.field_type == Field.PRIMARY_KEY):
+            continue
+        values = dict.fromkeys(columns)
+        for col in relation.columns:
+            if col.path and col.translated_path in flat:
+                values[col.target_name] = col.conversion_function(flat[col.translated_path], **col.conversion_args)
+        if any(value is not None for value in values.values()):
+            rows.append(tuple(values.values()))
+    return rows
+
+
+def test_extraction_plans_match_the_flattener():
+    relations = RelationBuilder().calculate_relations(copy.deepcopy(RELATIONS), copy.deepcopy(MAPPINGS))
+    relations = TableBuilder(relations, copy.deepcopy(MAPPINGS)).get_relations()
+    plans = [ExtractionPlan(relation) for relation in relations]
+    shared_plan = SharedExtractionPlan(plans)
+    rng = random.Random(5)
+    for _ in range(3000):
+        doc = {key: random_value(rng, child) for key, child in SHAPE.items() if rng.random() < 0.8}
+        shared_rows = shared_plan.extract(doc)
+        for relation, plan, shared in zip(relations, plans, shared_rows):
+            expected = sorted(flattened_rows(doc, relation, plan.columns), key=repr)
+            assert sorted(plan.extract(doc), key=repr) == expected, (relation.info, doc)
+            assert sorted(shared, key=repr) == expected, (relation.info, doc)
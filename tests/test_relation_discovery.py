@@ -0,0 +1,39 @@
+from mongrel_transferrer.mongrel.relation_discovery.configuration_builder import ConfigurationBuilder
+
+
+class FakeCollection:
+    """
+    The part of a pymongo collection the discovery with a single worker reads
+    """
+
+    def __init__(self, name: str, documents: list[dict]):
+        self.name = name
+        self.documents = documents
+
+    def count_documents(self, _query: dict) -> int:
+        return len(self.documents)
+
+    def find(self) -> list[dict]:
+        return self.documents
+
+
+def build_tracks(album_repeats: int) -> list[dict]:
+    """
+    :param album_repeats: how often every album id appears
+    :return: tracks whose album subdocuments repeat every scalar column, the id least often. The label subdocument
+    of every album is distinct, so the album table has a unique column that can't be its primary key
+    """
+    return [{"name": f"track{idx}",
+             "album": {"id": idx // album_repeats, "name": f"album{idx // 4}", "type": "single" if idx % 3 else "album",
+                       "popularity": idx % 5, "label": {"name": f"label{idx}"}}} for idx in range(200)]
+
+
+def test_repeated_columns_keep_the_unique_id():
+    mappings, _ = ConfigurationBuilder.build_configuration(FakeCollection("tracks", build_tracks(1)))
+    assert mappings["public.album"]["transfer_options"]["reference_keys"] == {"id": "PK"}
+
+
+def test_primary_key_candidate_survives_when_every_column_repeats():
+    mappings, _ = ConfigurationBuilder.build_configuration(FakeCollection("tracks", build_tracks(2)))
+    assert mappings["public.album"]["transfer_options"]["reference_keys"] == {"id": "PK"}
+    assert mappings["public.tracks"]["transfer_options"]["reference_keys"] == {"name": "PK"}
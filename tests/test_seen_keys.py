@@ -0,0 +1,41 @@
+from mongrel_transferrer.mongrel.helpers.types.seen_keys import ExistingKeys
+from mongrel_transferrer.mongrel.objects.options import resolve_options
+from mongrel_transferrer.mongrel.objects.transferrer import Transferrer, EXISTING_KEY_CACHE
+
+
+class FakeConnection:
+    """
+    Counts the commits of the transaction that read the keys
+    """
+
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self) -> None:
+        self.commits += 1
+
+
+def test_existing_keys_match_typed_and_string_values():
+    keys = ExistingKeys()
+    keys.add((1, "a"))
+    keys.add(("2", "b"))
+    assert ("1", "a") in keys
+    assert (2, "b") in keys
+    assert (1, "b") not in keys
+    assert ("1a",) not in keys
+    assert len(keys) == 2
+
+
+def test_existing_keys_are_loaded_once_per_process(monkeypatch):
+    transferrer = Transferrer.__new__(Transferrer)
+    transferrer.options = resolve_options()
+    transferrer.mongo_database, transferrer.mongo_collection = "test", "tracks"
+    loads = []
+    monkeypatch.setattr(transferrer, "load_existing_keys", lambda connection: loads.append(connection) or {})
+    connection = FakeConnection()
+    try:
+        first = transferrer.get_existing_keys(connection)
+        assert transferrer.get_existing_keys(FakeConnection()) is first
+        assert loads == [connection] and connection.commits == 1
+    finally:
+        EXISTING_KEY_CACHE.clear()
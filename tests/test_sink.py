@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+
+from mongrel_transferrer.mongrel.objects.sink import FileSink, LOAD_SCRIPT_NAME
+from mongrel_transferrer.mongrel.objects.table import TableInfo
+
+VALUES = ["plain", "", None, "\\N", "a,b", 'say "hi"', "line\nbreak", "\\.", " padded "]
+
+
+def read_copy_csv(path: str) -> tuple[list[str], list[list]]:
+    """
+    Reads a csv file the way COPY ... WITH (FORMAT csv, HEADER, NULL '\\N') does, only unquoted \\N fields are null
+    :param path: the path of the file
+    :return: the header and the rows
+    """
+    with open(path, encoding="utf-8", newline="") as file:
+        text = file.read()
+    rows, row, field = [], [], []
+    quoted = in_quotes = False
+    position = 0
+    while position < len(text):
+        character = text[position]
+        if in_quotes:
+            if character == '"' and text[position + 1:position + 2] == '"':
+                field.append('"')
+                position += 1
+            elif character == '"':
+                in_quotes = False
+            else:
+                field.append(character)
+        elif character == '"':
+            in_quotes = quoted = True
+        elif character in ",\n":
+            value = "".join(field)
+            row.append(None if not quoted and value == "\\N" else value)
+            field, quoted = [], False
+            if character == "\n":
+                rows.append(row)
+                row = []
+        else:
+            field.append(character)
+        position += 1
+    return rows[0], rows[1:]
+
+
+def test_csv_files_round_trip_nulls_and_special_strings(tmp_path):
+    sink = FileSink(str(tmp_path), chunk_rows=4)
+    album = TableInfo("music.album")
+    frame = pd.DataFrame({"id": range(len(VALUES)), "name": VALUES,
+                          "tracks": [None if idx % 3 == 0 else idx for idx in range(len(VALUES))]})
+    with sink.connect("part") as connection:
+        sink.write(album, frame, connection)
+    rows = []
+    directory = os.path.join(tmp_path, str(album))
+    for name in sorted(os.listdir(directory)):
+        header, chunk = read_copy_csv(os.path.join(directory, name))
+        assert header == ["id", "name", "tracks"]
+        rows.extend(chunk)
+    assert rows == [[str(idx), value, None if idx % 3 == 0 else str(idx)] for idx, value in enumerate(VALUES)]
+
+
+def test_load_script_merges_the_files_of_all_partitions(tmp_path):
+    sink = FileSink(str(tmp_path))
+    sink.prepare("CREATE TABLE ...;")
+    artists, album = TableInfo("music.artists"), TableInfo("music.album")
+    for partition in ("first", "second"):
+        with sink.connect(partition) as connection:
+            # both partitions reference the same parents, their rows are written twice
+            sink.write(artists, pd.DataFrame({"id": ["a1", "a2"]}), connection)
+            sink.write(album, pd.DataFrame({"id": [partition], "artist": ["a1"]}), connection)
+    sink.finish([artists, album])
+    with open(os.path.join(tmp_path, LOAD_SCRIPT_NAME), encoding="utf-8") as file:
+        script = file.read().splitlines()
+    copies = [line for line in script if line.startswith("\\copy")]
+    assert copies == [
+        "\\copy \"mongrel_stage_music_artists\" (\"id\") FROM 'music.artists/first-00000.csv' "
+        "WITH (FORMAT csv, HEADER, NULL '\\N')",
+        "\\copy \"mongrel_stage_music_artists\" (\"id\") FROM 'music.artists/second-00000.csv' "
+        "WITH (FORMAT csv, HEADER, NULL '\\N')",
+        "\\copy \"mongrel_stage_music_album\" (\"id\", \"artist\") FROM 'music.album/first-00000.csv' "
+        "WITH (FORMAT csv, HEADER, NULL '\\N')",
+        "\\copy \"mongrel_stage_music_album\" (\"id\", \"artist\") FROM 'music.album/second-00000.csv' "
+        "WITH (FORMAT csv, HEADER, NULL '\\N')"]
+    merges = [line for line in script if line.startswith("INSERT")]
+    assert merges == [
+        'INSERT INTO "music"."artists" SELECT * FROM "mongrel_stage_music_artists" ON CONFLICT DO NOTHING;',
+        'INSERT INTO "music"."album" SELECT * FROM "mongrel_stage_music_album" ON CONFLICT DO NOTHING;']